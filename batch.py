@@ -0,0 +1,124 @@
+import pandas as pd
+import argparse
+import os
+import time
+import xlsxwriter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import excel_report
+import pizza_analysis_cleaning as pac
+
+
+def read_manifest(path):
+    """
+    Store directories listed in a manifest file, one per line and relative
+    to the manifest. Blank lines and lines starting with # are skipped.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as file:
+        lines = [line.strip() for line in file]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+
+def process_store(directory, catalogue, pizza_ingredients, refresh=False, raw_rows=None):
+    """
+    Write the report and the optimal ingredients of the store whose csv
+    files are in directory, next to them. The Excel file is written by
+    the same worker that cleaned the data, so the writes of a store
+    overlap with the cleaning of the stores in the other workers and the
+    orders never travel between processes. Returns the parts of the
+    report that go into the roll-up and the date of the first order,
+    from which the weeks of the store are counted.
+    """
+    report = excel_report.compute_report(catalogue, pizza_ingredients, directory, refresh=refresh)
+    optimal_ingredients, df_orders, _, df_categories, _, df_weekly_pizzas_total, df_profits = report
+    excel_report.create_excel(*report, raw_rows, os.path.join(directory, "report.xlsx"), catalogue)
+    pac.create_csv(optimal_ingredients, os.path.join(directory, "optimal_ingredients.csv"))
+    return optimal_ingredients, df_categories, df_weekly_pizzas_total, df_profits, df_orders["date"].min()
+
+
+def week_starts(table, key, first_date):
+    """
+    Copy of a store's table numbered by week (counted from first_date, see
+    pac.obtain_weeks) keyed instead by the date each week starts on, so
+    stores whose orders start on different days can be compared.
+    """
+    starts = pd.Timestamp(first_date) + pd.to_timedelta((table[key] - 1) * 7, unit="D")
+    return table.drop(columns=key).assign(**{"week start": starts.dt.strftime("%Y-%m-%d")})
+
+
+def side_by_side(tables, key, value, sort=False):
+    """
+    DataFrame with the value column of every store's table next to each
+    other, matched by key, and a total column. sort orders the rows by key.
+    """
+    df = pd.concat({store: table.set_index(key)[value] for store, table in tables.items()}, axis=1)
+    if sort:
+        df = df.sort_index()
+    df = df.fillna(0)
+    df["total"] = df.sum(axis=1)
+    return df.rename_axis(key).reset_index()
+
+
+def create_rollup(results, path="rollup.xlsx"):
+    """
+    Write an Excel file with the optimal ingredients, the pizzas sold by
+    category, the orders by week and the profits by week of every store
+    next to each other, plus their totals. The weeks are matched by the
+    date they start on (see week_starts), as every store counts them
+    from its own first order. Returns the DataFrames written.
+    """
+    ingredients = {store: result[0].rename_axis("Ingredients").reset_index() for store, result in results.items()}
+    weekly_orders = {store: week_starts(result[2], "weeks", result[4]) for store, result in results.items()}
+    profits = {store: week_starts(result[3], "week", result[4]) for store, result in results.items()}
+    frames = {"optimal_ingredients": side_by_side(ingredients, "Ingredients", "Quantity"),
+              "categories": side_by_side({store: result[1] for store, result in results.items()},
+                                         "categories", "counts"),
+              "weekly_orders": side_by_side(weekly_orders, "week start", "orders", sort=True),
+              "profits": side_by_side(profits, "week start", "profit", sort=True)}
+
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+    for name, df in frames.items():
+        excel_report.write_frames(workbook.add_worksheet(name), [(0, df)], header_format)
+    workbook.close()
+    return frames
+
+
+def run_batch(stores, catalogue_directory=".", jobs=None, refresh=False, raw_rows=None, output="rollup.xlsx"):
+    """
+    Create the report of every store in a pool of jobs processes (one per
+    core by default) and a roll-up of all of them. The catalogue is parsed
+    once and shared by every store.
+    """
+    df_pizzas = pd.read_csv(os.path.join(catalogue_directory, "pizzas.csv"))
+    df_pizza_types = pd.read_csv(os.path.join(catalogue_directory, "pizza_types.csv"), encoding="latin1")
+    pizza_ingredients = pac.create_pizza_ingredients(df_pizza_types)
+    catalogue = pac.create_catalogue(df_pizzas, df_pizza_types)
+
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = {executor.submit(process_store, store, catalogue, pizza_ingredients, refresh, raw_rows): store
+                   for store in stores}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            print(f"{futures[future]}: {time.perf_counter() - start:.2f} s")
+
+    names = [os.path.basename(os.path.normpath(store)) for store in stores]
+    if len(set(names)) < len(names):
+        names = stores
+    return create_rollup({name: results[store] for name, store in zip(names, stores)}, output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="file with the directory of every store, one per line")
+    parser.add_argument("--catalogue", default=".", help="directory with pizzas.csv and pizza_types.csv")
+    parser.add_argument("--jobs", type=int, default=None, help="processes used (one per core by default)")
+    parser.add_argument("--refresh", action="store_true", help="rebuild the cached cleaned data")
+    parser.add_argument("--raw-rows", type=int, default=None,
+                        help="rows sampled for the orders and order details sheets, 0 leaves them out")
+    parser.add_argument("--output", default="rollup.xlsx", help="Excel file with the roll-up of every store")
+    args = parser.parse_args()
+
+    run_batch(read_manifest(args.manifest), args.catalogue, args.jobs, args.refresh, args.raw_rows, args.output)
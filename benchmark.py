@@ -0,0 +1,232 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import cache
+import excel_report
+import instrumentation
+import pizza_analysis_cleaning as pac
+
+# Formats of the dates and times of orders.csv and how often each one appears.
+DATE_FORMATS = {"%b %d %Y": 0.160, "%A,%d %B, %Y": 0.156, "%d-%m-%y %H:%M:%S": 0.153,
+                "%a %d-%b-%Y": 0.153, "%Y-%m-%d": 0.151, "timestamp": 0.116, "nan": 0.111}
+TIME_FORMATS = {"%H:%M:%S": 0.300, "%HH %MM %SS": 0.305, "%H:%M %p": 0.300, "nan": 0.095}
+# Corruptions of the pizza ids of order_details.csv and spellings of the quantities.
+PIZZA_CORRUPTIONS = {"": 0.60, " ": 0.09, "-": 0.09, "3": 0.04, "@": 0.04, "0": 0.03, "nan": 0.11}
+QUANTITIES = {"1": 0.712, "one": 0.107, "nan": 0.097, "One": 0.038, "-1": 0.028,
+              "2": 0.016, "-2": 0.001, "3": 0.0005, "two": 0.0003, "4": 0.0002}
+LINES_PER_ORDER = 48620 / 21350
+SIZES = [10000, 100000, 1000000, 10000000]
+
+
+def draw(rng, options, size):
+    """
+    Indexes of the keys of options drawn with their probabilities.
+    """
+    probabilities = np.array(list(options.values()))
+    return rng.choice(len(options), size=size, p=probabilities / probabilities.sum())
+
+
+def format_dates(days, date_format):
+    """
+    Every day of the year written in one of the formats of orders.csv.
+    """
+    if date_format == "timestamp":
+        return np.array([f"{float(day.timestamp())}" for day in days], dtype=object)
+    if date_format == "%b %d %Y":
+        # orders.csv doesn't pad the day of this format with a zero ("Nov 3 2016").
+        return np.array([f"{day:%b} {day.day} {day:%Y}" for day in days], dtype=object)
+    return np.array([day.strftime(date_format) for day in days], dtype=object)
+
+
+def format_times(time_format):
+    """
+    Every second of a day written in one of the formats of orders.csv.
+    """
+    seconds = np.arange(86400)
+    clock = zip(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    if time_format == "%H:%M:%S":
+        return np.array([f"{h:02d}:{m:02d}:{s:02d}" for h, m, s in clock], dtype=object)
+    if time_format == "%HH %MM %SS":
+        return np.array([f"{h:02d}H {m:02d}M {s:02d}S" for h, m, s in clock], dtype=object)
+    return np.array([f"{h:02d}:{m:02d} {'PM' if h >= 12 else 'AM'}" for h, m, _ in clock], dtype=object)
+
+
+def generate_orders(n_orders, rng, year=2016):
+    """
+    DataFrame of orders spread over a year, with the dates and times
+    written in the same messy formats as orders.csv. One in ten orders
+    gets a time of midnight, as the unknown times of the original data.
+    """
+    days = pd.date_range(f"{year}-01-01", f"{year}-12-31")
+    order_days = np.arange(n_orders) * len(days) // n_orders
+    order_seconds = rng.integers(11 * 3600, 23 * 3600, size=n_orders)
+    order_seconds[rng.random(n_orders) < 0.1] = 0
+
+    dates = np.full(n_orders, np.nan, dtype=object)
+    date_formats = draw(rng, DATE_FORMATS, n_orders)
+    for i, date_format in enumerate(DATE_FORMATS):
+        if date_format != "nan":
+            group = date_formats == i
+            dates[group] = format_dates(days, date_format)[order_days[group]]
+
+    times = np.full(n_orders, np.nan, dtype=object)
+    time_formats = draw(rng, TIME_FORMATS, n_orders)
+    for i, time_format in enumerate(TIME_FORMATS):
+        if time_format != "nan":
+            group = time_formats == i
+            times[group] = format_times(time_format)[order_seconds[group]]
+
+    df_orders = pd.DataFrame({"order_id": np.arange(1, n_orders + 1), "date": dates, "time": times})
+    return df_orders.iloc[rng.permutation(n_orders)]
+
+
+def generate_order_details(n_lines, n_orders, pizza_ids, rng):
+    """
+    DataFrame of order details with at least one line per order, with the
+    same pizza id corruptions and quantity spellings as order_details.csv.
+    """
+    order_ids = np.sort(np.concatenate([np.arange(1, n_orders + 1),
+                                        rng.integers(1, n_orders + 1, size=n_lines - n_orders)]))
+    pizzas = rng.integers(len(pizza_ids), size=n_lines)
+    corruptions = draw(rng, PIZZA_CORRUPTIONS, n_lines)
+    replacements = {" ": ("_", " "), "-": ("_", "-"), "3": ("e", "3"), "@": ("a", "@"), "0": ("o", "0")}
+    pizza_column = np.full(n_lines, np.nan, dtype=object)
+    for i, corruption in enumerate(PIZZA_CORRUPTIONS):
+        if corruption != "nan":
+            group = corruptions == i
+            table = np.array(pizza_ids, dtype=object)
+            if corruption:
+                table = np.array([pizza.replace(*replacements[corruption]) for pizza in pizza_ids], dtype=object)
+            pizza_column[group] = table[pizzas[group]]
+
+    spellings = np.array([np.nan if quantity == "nan" else quantity for quantity in QUANTITIES], dtype=object)
+    quantities = spellings[draw(rng, QUANTITIES, n_lines)]
+
+    df_order_details = pd.DataFrame({"order_details_id": np.arange(1, n_lines + 1), "order_id": order_ids,
+                                     "pizza_id": pizza_column, "quantity": quantities})
+    return df_order_details.iloc[rng.permutation(n_lines)]
+
+
+def generate(directory, n_lines, seed=0):
+    """
+    Write a synthetic orders.csv and order_details.csv with n_lines order
+    details to directory, next to a copy of the real pizzas.csv and
+    pizza_types.csv. The same seed always gives the same files.
+    """
+    rng = np.random.default_rng(seed)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ["pizzas.csv", "pizza_types.csv"]:
+        shutil.copy(os.path.join(here, name), directory)
+    pizza_ids = list(pd.read_csv(os.path.join(here, "pizzas.csv"))["pizza_id"])
+    n_orders = max(1, min(n_lines, round(n_lines / LINES_PER_ORDER)))
+    generate_orders(n_orders, rng).to_csv(os.path.join(directory, "orders.csv"), sep=";", index=False)
+    generate_order_details(n_lines, n_orders, pizza_ids, rng).to_csv(
+        os.path.join(directory, "order_details.csv"), sep=";", index=False, encoding="latin1")
+
+
+def run_benchmark(sizes=SIZES, seed=0, workers=1, raw_rows=None, trace_memory=False):
+    """
+    Generate the data of every size and time every stage of the
+    excel_report pipeline on it. Returns the results as a dictionary.
+    """
+    results = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+               "seed": seed, "workers": workers, "raw_rows": raw_rows, "runs": []}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            generate(directory, size, seed)
+            generate_time = time.perf_counter() - start
+            run = instrumentation.start_run(trace_memory=trace_memory)
+            excel_report.create_report(run, refresh=True, workers=workers, raw_rows=raw_rows, directory=directory)
+            summary = instrumentation.write_summary(run)
+        results["runs"].append({"lines": size, "generate_time": generate_time, **summary})
+        print(f"{size} lines: {summary['wall_time']:.2f} s")
+    return results
+
+
+def check_appends(n_lines=20000, seed=0, kept=0.6):
+    """
+    Check that the cache cleans rows appended to orders.csv, to
+    order_details.csv or to both (see cache.load_cleaned_data) into the same
+    data as a run from scratch. The synthetic files are sorted by id and
+    only their first kept fraction of rows is cached before the rest is
+    appended. Raises an AssertionError if any of them differs.
+    """
+    rng = np.random.default_rng(seed)
+    here = os.path.dirname(os.path.abspath(__file__))
+    df_pizza_types = pd.read_csv(os.path.join(here, "pizza_types.csv"), encoding="latin1")
+    df_pizzas = pd.read_csv(os.path.join(here, "pizzas.csv"))
+    pizza_ingredients = pac.create_pizza_ingredients(df_pizza_types)
+    catalogue = pac.create_catalogue(df_pizzas, df_pizza_types)
+    n_orders = max(1, round(n_lines / LINES_PER_ORDER))
+    df_orders = generate_orders(n_orders, rng).sort_values("order_id")
+    df_order_details = generate_order_details(n_lines, n_orders, list(df_pizzas["pizza_id"]), rng)
+    df_order_details = df_order_details.sort_values("order_details_id")
+
+    for appended in [["orders"], ["order_details"], ["orders", "order_details"]]:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {name: os.path.join(directory, name + ".csv") for name in ["orders", "order_details"]}
+            for name, df in [("orders", df_orders), ("order_details", df_order_details)]:
+                df.iloc[:round(len(df) * kept)].to_csv(paths[name], sep=";", index=False, encoding="latin1")
+            cache.load_cleaned_data(paths["orders"], paths["order_details"], catalogue, pizza_ingredients,
+                                    cache_dir=os.path.join(directory, ".cache"))
+            for name, df in [("orders", df_orders), ("order_details", df_order_details)]:
+                if name in appended:
+                    df.to_csv(paths[name], sep=";", index=False, encoding="latin1")
+            incremental = cache.load_cleaned_data(paths["orders"], paths["order_details"], catalogue,
+                                                  pizza_ingredients, cache_dir=os.path.join(directory, ".cache"))
+            scratch = cache.load_cleaned_data(paths["orders"], paths["order_details"], catalogue,
+                                              pizza_ingredients, cache_dir=os.path.join(directory, ".scratch"))
+            for df_incremental, df_scratch in zip(incremental, scratch):
+                pd.testing.assert_frame_equal(df_incremental.reset_index(drop=True),
+                                              df_scratch.reset_index(drop=True))
+        print(f"appending to {' and '.join(appended)}: ok")
+
+
+def compare(results, previous):
+    """
+    Print the wall time of every stage next to the one of a previous run.
+    """
+    previous_runs = {run["lines"]: run for run in previous["runs"]}
+    for run in results["runs"]:
+        if run["lines"] not in previous_runs:
+            continue
+        previous_stages = {stage["stage"]: stage for stage in previous_runs[run["lines"]]["stages"]}
+        print(f"{run['lines']} lines")
+        for stage in run["stages"]:
+            if stage["stage"] in previous_stages:
+                before = previous_stages[stage["stage"]]["wall_time"]
+                print(f"    {stage['stage']:<30}{before:>10.3f} s{stage['wall_time']:>10.3f} s"
+                      f"{stage['wall_time'] / before if before else float('nan'):>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="order details lines of each run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="processes used to clean the data")
+    parser.add_argument("--raw-rows", type=int, default=None,
+                        help="rows sampled for the orders and order details sheets, 0 leaves them out")
+    parser.add_argument("--trace-memory", action="store_true", help="trace the memory of every stage (slower)")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file with the results")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--check-appends", action="store_true",
+                        help="only check that appending rows to the csv files gives the same cleaned data")
+    args = parser.parse_args()
+
+    if args.check_appends:
+        check_appends(seed=args.seed)
+        raise SystemExit
+
+    results = run_benchmark(args.sizes, args.seed, args.workers, args.raw_rows, args.trace_memory)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
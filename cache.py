@@ -0,0 +1,306 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import instrumentation
+import parallel
+import snapshot
+import pizza_analysis_cleaning as pac
+
+# Bumped whenever the layout of the cached DataFrames changes, so old
+# entries are never loaded.
+VERSION = 4
+
+
+def fingerprint(path, size=None):
+    """
+    Dictionary with the size in bytes, the number of rows and the sha256
+    of the first size bytes of a file (all of it by default).
+    """
+    sha256 = hashlib.sha256()
+    rows = 0
+    read = 0
+    with open(path, "rb") as file:
+        while size is None or read < size:
+            block = file.read(1 << 20 if size is None else min(1 << 20, size - read))
+            if not block:
+                break
+            sha256.update(block)
+            rows += block.count(b"\n")
+            read += len(block)
+            last = block[-1:]
+    return {"size": read, "rows": rows, "sha256": sha256.hexdigest(),
+            "newline": read == 0 or last == b"\n"}
+
+
+def catalogue_key(catalogue, pizza_ingredients, seed):
+    """
+    Hash of everything besides the orders the cleaned data depends on.
+    """
+    content = repr((VERSION, list(catalogue.index), list(catalogue["pizza_type_id"]), list(pizza_ingredients), seed))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def entry_key(meta):
+    content = json.dumps([meta["orders"], meta["order_details"], meta["catalogue"]], sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def find_entry(cache_dir, meta):
+    """
+    Look for a cache entry built from the same catalogue and from files
+    that the current ones extend by appending rows. Returns its metadata
+    or None.
+    """
+    if os.path.isfile(os.path.join(cache_dir, entry_key(meta) + ".json")):
+        with open(os.path.join(cache_dir, entry_key(meta) + ".json")) as file:
+            return json.load(file)
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(cache_dir, name)) as file:
+            old = json.load(file)
+        if old["catalogue"] != meta["catalogue"]:
+            continue
+        appended = True
+        for source in ["orders", "order_details"]:
+            previous = old[source]
+            appended &= (previous["newline"] and previous["size"] <= meta[source]["size"]
+                         and fingerprint(meta[source]["path"], previous["size"])["sha256"] == previous["sha256"])
+        if appended:
+            return old
+    return None
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    """
+    Remove the least recently used entries until the cache takes
+    less than max_bytes.
+    """
+    entries = {}
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        files = [path] if os.path.isfile(path) else [os.path.join(path, file) for file in os.listdir(path)]
+        mtime, size = entries.get(name.split(".")[0], (0, 0))
+        entries[name.split(".")[0]] = (max([mtime] + [os.path.getmtime(file) for file in files]),
+                                       size + sum(os.path.getsize(file) for file in files))
+    total = sum(size for _, size in entries.values())
+    for key, (_, size) in sorted(entries.items(), key=lambda entry: entry[1]):
+        if total <= max_bytes:
+            break
+        if key != keep:
+            remove_entry(cache_dir, key)
+            total -= size
+
+
+def remove_entry(cache_dir, key):
+    """
+    Remove the metadata and the snapshot of an entry, and whatever older
+    versions of the cache left under its key.
+    """
+    for name in os.listdir(cache_dir):
+        if name.split(".")[0] == key:
+            path = os.path.join(cache_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+def frame_arrays(df, name):
+    """
+    Columns of a DataFrame as arrays named "<name>.<column>", to be saved in
+    a snapshot, and the categories of its categorical columns, which are
+    saved as their codes.
+    """
+    arrays = {}
+    categories = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories[column] = values.cat.categories.tolist()
+            values = values.cat.codes
+        arrays[f"{name}.{column}"] = values.to_numpy()
+    return arrays, categories
+
+
+def snapshot_frame(entry, name, categories=None):
+    """
+    DataFrame with a 1-based index of the columns saved by frame_arrays,
+    wrapping the memory-mapped arrays of the snapshot without copying them.
+    """
+    categories = categories or {}
+    columns = {}
+    for array in entry["arrays"]:
+        if array.startswith(name + "."):
+            column = array[len(name) + 1:]
+            values = entry[array]
+            if column in categories:
+                values = pd.Categorical.from_codes(values, categories[column])
+            columns[column] = values
+    length = len(next(iter(columns.values())))
+    return pd.DataFrame(columns, index=pd.RangeIndex(1, length + 1), copy=False)
+
+
+def weekly_frame(entry):
+    """
+    DataFrame of the pizzas sold every week saved in a snapshot, wrapping
+    its memory-mapped counts.
+    """
+    counts = entry["counts"]
+    df_weekly_pizzas = pd.DataFrame(counts, columns=[f"week {week}" for week in range(1, counts.shape[1] + 1)],
+                                    copy=False)
+    df_weekly_pizzas.insert(0, "pizza", entry["pizzas"])
+    return df_weekly_pizzas
+
+
+def write_snapshot(path, sources, df_orders, cleaned_orders, df_order_details, df_weekly_pizzas, first_date, drawn,
+                   catalogue, pizza_ingredients):
+    """
+    Save an entry as a snapshot (see snapshot.save_snapshot): the columns
+    of the normalized and cleaned orders and of the cleaned order details,
+    the pizzas sold every week and every day, the number of full weeks
+    (see pac.obtain_full_weeks), and the ingredients and
+    price of every pizza, so the optimal ingredients can be computed
+    again with numpy alone.
+    """
+    pizzas = df_weekly_pizzas["pizza"]
+    incidence = pac.create_incidence(pizza_ingredients).loc[pizzas]
+    daily, first_weekday = pac.count_daily_pizzas(cleaned_orders, df_order_details, catalogue, pizza_ingredients)
+    orders, _ = frame_arrays(df_orders, "orders")
+    cleaned, _ = frame_arrays(cleaned_orders, "cleaned")
+    details, categories = frame_arrays(df_order_details, "details")
+    meta = {"categories": categories, "first_date": first_date.isoformat(), "drawn": drawn,
+            "pizzas": pizzas.tolist(), "ingredients": incidence.columns.tolist(), "first_weekday": int(first_weekday),
+            "full_weeks": int(pac.obtain_full_weeks(cleaned_orders))}
+    snapshot.save_snapshot(path, sources, meta, **orders, **cleaned, **details,
+                           counts=df_weekly_pizzas.drop(columns="pizza").to_numpy(dtype=np.int64), daily=daily,
+                           incidence=incidence.to_numpy(),
+                           prices=pac.obtain_prices(catalogue).loc[pizzas, "price"].to_numpy())
+
+
+def update_weekly_pizzas(df_weekly_pizzas, old_weeks, weeks, new_details, df_order_details,
+                         catalogue, pizza_ingredients):
+    """
+    Recount only the weeks affected by the new rows: the weeks of the
+    orders whose week changed or that are new, and the weeks of the
+    orders of the new order details.
+    """
+    common = old_weeks.index.intersection(weeks.index)
+    changed = old_weeks[common] != weeks[common]
+    affected = set(old_weeks[common][changed]) | set(weeks[common][changed])
+    affected |= set(weeks[weeks.index.difference(old_weeks.index)])
+    affected |= set(weeks.reindex(new_details["order_id"]).dropna().astype(int))
+
+    df_weekly_pizzas = df_weekly_pizzas.reindex(columns=["pizza"] + [f"week {week}" for week in range(1, weeks.max() + 1)],
+                                                fill_value=0)
+    if affected:
+        in_affected = df_order_details["order_id"].map(weeks).isin(affected)
+        recount = pac.count_weekly_pizzas(weeks, df_order_details[in_affected], catalogue, pizza_ingredients)
+        columns = [f"week {week}" for week in sorted(affected)]
+        df_weekly_pizzas[columns] = recount[columns].values
+    return df_weekly_pizzas
+
+
+def load_cleaned_data(orders_path, order_details_path, catalogue, pizza_ingredients, seed=0,
+                      cache_dir=".cache", max_bytes=1 << 30, invalidate=False, workers=1, run=None):
+    """
+    Return the cleaned orders, the cleaned order details and the pizzas sold
+    every week (without mean and optimal), reusing what was computed in
+    earlier runs. Entries are keyed by the content hash and row count of
+    the input files. When the files only got new rows appended, only those
+    rows are cleaned and only the affected weeks are recounted.
+    invalidate removes every entry and rebuilds everything from scratch.
+    Full rebuilds are normalized in workers processes. Every entry is a
+    snapshot of .npy columns (see write_snapshot), and the DataFrames
+    returned from it wrap its memory-mapped arrays, so loading them costs
+    next to nothing and processes loading the same entry share its pages.
+    The normalize, fill, count and write steps are recorded in run as
+    stages of their own (see instrumentation).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    if invalidate:
+        for name in os.listdir(cache_dir):
+            remove_entry(cache_dir, name.split(".")[0])
+
+    meta = {"orders": fingerprint(orders_path), "order_details": fingerprint(order_details_path),
+            "catalogue": catalogue_key(catalogue, pizza_ingredients, seed)}
+    meta["orders"]["path"] = orders_path
+    meta["order_details"]["path"] = order_details_path
+    key = entry_key(meta)
+    sources = [orders_path, order_details_path]
+    old = find_entry(cache_dir, meta)
+
+    entry = None
+    if old is not None:
+        path = os.path.join(cache_dir, entry_key(old))
+        entry = instrumentation.run_stage(run, "open_snapshot", snapshot.open_snapshot, path)
+    if entry is not None:
+        old_orders = snapshot_frame(entry, "orders")
+        old_details = snapshot_frame(entry, "details", entry["categories"])
+        if entry_key(old) == key:
+            snapshot.touch_snapshot(path, sources)
+            return snapshot_frame(entry, "cleaned"), old_details, weekly_frame(entry)
+        new_orders = instrumentation.run_stage(run, "normalize_orders", parallel.normalize_orders_shard,
+                                               orders_path, old["orders"]["size"], None)
+        new_details = instrumentation.run_stage(run, "normalize_order_details", parallel.normalize_order_details_shard,
+                                                order_details_path, old["order_details"]["size"], None)
+        if len(new_details) and new_details["order_details_id"].min() <= old_details["order_details_id"].max():
+            # The new details would be interleaved with the cached ones,
+            # which changes the draws of their missing pizzas.
+            entry = None
+
+    if entry is None:
+        if workers > 1:
+            df_orders = instrumentation.run_stage(run, "normalize_orders", parallel.normalize_orders,
+                                                  orders_path, workers)
+            new_details = instrumentation.run_stage(run, "normalize_order_details", parallel.normalize_order_details,
+                                                    order_details_path, workers)
+        else:
+            df_orders = instrumentation.run_stage(run, "normalize_orders", parallel.normalize_orders_shard,
+                                                  orders_path, 0, None)
+            new_details = instrumentation.run_stage(run, "normalize_order_details",
+                                                    parallel.normalize_order_details_shard, order_details_path, 0, None)
+        drawn = 0
+    else:
+        df_orders = old_orders
+        if len(new_orders):
+            df_orders = pd.concat([old_orders, new_orders]).sort_values("order_id")
+            df_orders.index = np.arange(1, len(df_orders) + 1)
+        drawn = entry["drawn"]
+    missing = int(new_details["pizza_id"].isna().sum())
+    new_details = instrumentation.run_stage(run, "fill_order_details", pac.fill_order_details, catalogue,
+                                            new_details, seed, drawn)
+    if entry is None:
+        df_order_details = new_details
+    else:
+        df_order_details = old_details
+        if len(new_details):
+            df_order_details = pd.concat([old_details, new_details])
+            df_order_details.index = np.arange(1, len(df_order_details) + 1)
+
+    cleaned_orders = instrumentation.run_stage(run, "fill_orders", pac.fill_orders, df_orders.copy())
+    weeks = pac.obtain_weeks(cleaned_orders)
+    first_date = cleaned_orders["date"].min()
+    if entry is None or pd.Timestamp(entry["first_date"]) != first_date:
+        # Weeks are counted from the first order, so all of them move.
+        df_weekly_pizzas = instrumentation.run_stage(run, "count_weekly_pizzas", pac.count_weekly_pizzas, weeks,
+                                                     df_order_details, catalogue, pizza_ingredients)
+    else:
+        old_weeks = pac.obtain_weeks(snapshot_frame(entry, "cleaned"))
+        df_weekly_pizzas = instrumentation.run_stage(run, "count_weekly_pizzas", update_weekly_pizzas,
+                                                     weekly_frame(entry), old_weeks, weeks, new_details,
+                                                     df_order_details, catalogue, pizza_ingredients)
+    # The old entry is only removed once the new one is written, so a
+    # failed run leaves the cache as it was.
+    instrumentation.run_stage(run, "write_snapshot", write_snapshot, os.path.join(cache_dir, key), sources,
+                              df_orders, cleaned_orders, df_order_details, df_weekly_pizzas, first_date,
+                              drawn + missing, catalogue, pizza_ingredients)
+    with open(os.path.join(cache_dir, key + ".json"), "w") as file:
+        json.dump(meta, file)
+    if old is not None and entry_key(old) != key:
+        remove_entry(cache_dir, entry_key(old))
+    evict(cache_dir, max_bytes, keep=key)
+    return cleaned_orders, df_order_details, df_weekly_pizzas
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import sys
+
+# Only the modules each command needs are imported, inside the command,
+# so optimize can answer from the snapshot without loading pandas.
+
+
+def load_snapshot(directory=".", catalogue_directory=None, refresh=False):
+    """
+    Snapshot of the pizzas sold every week and every day in the csv files
+    of directory (see cache.write_snapshot). It is read straight from the
+    cache as long as the csv files haven't changed since it was saved,
+    which only takes numpy. Otherwise the orders are cleaned and cached first.
+    """
+    import snapshot
+    if catalogue_directory is None:
+        catalogue_directory = directory
+    cache_dir = os.path.join(directory, ".cache")
+    sources = [os.path.join(directory, "orders.csv"), os.path.join(directory, "order_details.csv")]
+    dependencies = [os.path.join(catalogue_directory, "pizzas.csv"), os.path.join(catalogue_directory, "pizza_types.csv")]
+    counts = None if refresh else snapshot.find_snapshot(cache_dir, sources, dependencies)
+    if counts is None:
+        import pandas as pd
+        import cache
+        import pizza_analysis_cleaning as pac
+        df_pizza_types = pd.read_csv(dependencies[1], encoding="latin1")
+        catalogue = pac.create_catalogue(pd.read_csv(dependencies[0]), df_pizza_types)
+        cache.load_cleaned_data(sources[0], sources[1], catalogue, pac.create_pizza_ingredients(df_pizza_types),
+                                cache_dir=cache_dir, invalidate=refresh)
+        counts = snapshot.find_snapshot(cache_dir, sources, dependencies)
+    return counts
+
+
+def optimize(directory=".", catalogue_directory=None, margin=0.15, cost=0.85, refresh=False,
+             method=None, parameter=None):
+    """
+    Dictionary with the amount of each ingredient we need to make the
+    optimal number of pizzas every week, or the week after the last one
+    when a forecasting method is given (see pac.add_optimal).
+    """
+    import optimization
+    counts = load_snapshot(directory, catalogue_directory, refresh)
+    demand = counts["counts"][:, :counts["full_weeks"]]
+    if method is None:
+        stock = optimization.optimize_stock(demand, margin, cost)
+    else:
+        import forecasting
+        stock = forecasting.plan_stock(demand, forecasting.forecast(demand, method, parameter), margin, cost)[:, -1]
+    quantities = optimization.obtain_ingredient_demand(counts["incidence"], stock)
+    return dict(zip(counts["ingredients"], quantities.tolist()))
+
+
+def backtest_demand(counts, daily=False, seasonal=False):
+    """
+    (pizzas x periods) demand of a snapshot (see load_snapshot) that
+    backtest plans the stock of: every day or every full week.
+    """
+    return counts["daily"] if daily or seasonal else counts["counts"][:, :counts["full_weeks"]]
+
+
+def backtest(directory=".", catalogue_directory=None, method="smoothing", parameters=None, margin=0.15, cost=0.85,
+             start=4, daily=False, seasonal=False, refresh=False, counts=None):
+    """
+    Profit and waste over the year of the stock planned from the forecasts
+    of every parameter (see forecasting.backtest), weekly or daily and with
+    the day of the week seasonality, next to the ones of the static
+    optimal of optimize_stock chosen every period from the periods before
+    it (see forecasting.expanding_stock). Returns a list of dictionaries,
+    the static one first. counts is the snapshot, if it is already loaded.
+    """
+    import numpy as np
+    import forecasting
+    import optimization
+    if parameters is None:
+        parameters = [1, 2, 4, 8, 13, 26] if method == "rolling" else np.round(np.arange(0.1, 1, 0.1), 1).tolist()
+    if counts is None:
+        counts = load_snapshot(directory, catalogue_directory, refresh)
+    prices = counts["prices"]
+    demand = backtest_demand(counts, daily, seasonal)
+    first_weekday = counts["first_weekday"] if seasonal else None
+
+    stock = forecasting.expanding_stock(demand, margin, cost, start)[:, :-1]
+    profit, waste = optimization.simulate_profits(demand[:, start:], prices, stock, margin, cost, per_period=True)
+    results = [{"parameter": "static", "profit": float(profit.sum()), "waste": int(waste.sum())}]
+    profits, wastes = forecasting.backtest(demand, prices, method, parameters, margin, cost, start, first_weekday)
+    for parameter, profit, waste in zip(parameters, profits.tolist(), wastes.tolist()):
+        results.append({"parameter": parameter, "profit": profit, "waste": int(waste)})
+    return results
+
+
+def report(directory=".", output=None, refresh=False, workers=1, raw_rows=None, summary=None, profile=None):
+    """
+    Write the Excel report of the csv files in directory (see excel_report.create_report).
+    """
+    import excel_report
+    import instrumentation
+    run = None
+    if summary or profile:
+        run = instrumentation.start_run(profile_dir=profile)
+    excel_report.create_report(run, refresh, workers, raw_rows, directory, output)
+    if run is not None and summary:
+        instrumentation.write_summary(run, summary)
+
+
+def profile_data(directory=".", output=None):
+    """
+    Write the data quality report of the csv files in directory
+    (see pac.create_inform), to reporte_calidad_2016.csv by default.
+    """
+    import pandas as pd
+    import pizza_analysis_cleaning as pac
+    df_orders = pd.read_csv(os.path.join(directory, "orders.csv"), sep=";")
+    df_order_details = pd.read_csv(os.path.join(directory, "order_details.csv"), sep=";", encoding="latin1")
+    df_pizzas = pd.read_csv(os.path.join(directory, "pizzas.csv"))
+    df_pizza_types = pd.read_csv(os.path.join(directory, "pizza_types.csv"), encoding="latin1")
+    catalogue = pac.create_catalogue(df_pizzas, df_pizza_types)
+    if output is None:
+        output = os.path.join(directory, "reporte_calidad_2016.csv")
+    pac.create_inform([df_orders, df_order_details, df_pizzas, df_pizza_types],
+                      ["orders", "order_details", "pizzas", "pizza_types"], catalogue, output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    optimize_parser = subparsers.add_parser("optimize", help="print the optimal ingredients as JSON")
+    optimize_parser.add_argument("--directory", default=".", help="directory with the csv files")
+    optimize_parser.add_argument("--catalogue", help="directory with pizzas.csv and pizza_types.csv "
+                                                     "(the same directory by default)")
+    optimize_parser.add_argument("--margin", type=float, default=0.15, help="margin as a fraction of the price")
+    optimize_parser.add_argument("--cost", type=float, default=0.85, help="cost as a fraction of the price")
+    optimize_parser.add_argument("--refresh", action="store_true", help="rebuild the cached cleaned data")
+    optimize_parser.add_argument("--method", choices=["rolling", "smoothing"],
+                                 help="plan the stock of next week from a forecast instead")
+    optimize_parser.add_argument("--parameter", type=float,
+                                 help="window of the rolling mean (4 by default) or alpha of the smoothing "
+                                      "(0.3 by default)")
+    optimize_parser.add_argument("--output", help="JSON file written (printed by default)")
+
+    report_parser = subparsers.add_parser("report", help="write the Excel report")
+    report_parser.add_argument("--directory", default=".", help="directory with the csv files")
+    report_parser.add_argument("--output", help="Excel file written (report.xlsx in the directory by default)")
+    report_parser.add_argument("--refresh", action="store_true", help="rebuild the cached cleaned data")
+    report_parser.add_argument("--workers", type=int, default=1, help="processes used to clean the data")
+    report_parser.add_argument("--raw-rows", type=int, default=None,
+                               help="rows sampled for the orders and order details sheets, 0 leaves them out")
+    report_parser.add_argument("--summary", help="JSON file with the time and memory of every stage")
+    report_parser.add_argument("--profile", help="directory with a cProfile dump of every stage")
+
+    backtest_parser = subparsers.add_parser("backtest", help="compare the profits of forecasting parameters")
+    backtest_parser.add_argument("--directory", default=".", help="directory with the csv files")
+    backtest_parser.add_argument("--catalogue", help="directory with pizzas.csv and pizza_types.csv "
+                                                     "(the same directory by default)")
+    backtest_parser.add_argument("--method", choices=["rolling", "smoothing"], default="smoothing")
+    backtest_parser.add_argument("--parameters", type=float, nargs="+",
+                                 help="windows or alphas tried (a few of them by default)")
+    backtest_parser.add_argument("--margin", type=float, default=0.15, help="margin as a fraction of the price")
+    backtest_parser.add_argument("--cost", type=float, default=0.85, help="cost as a fraction of the price")
+    backtest_parser.add_argument("--start", type=int, default=4, help="periods used only to start the forecasts")
+    backtest_parser.add_argument("--daily", action="store_true", help="plan the stock of every day")
+    backtest_parser.add_argument("--seasonal", action="store_true",
+                                 help="plan the stock of every day with the day of the week seasonality")
+    backtest_parser.add_argument("--refresh", action="store_true", help="rebuild the cached cleaned data")
+
+    profile_parser = subparsers.add_parser("profile", help="write the data quality report")
+    profile_parser.add_argument("--directory", default=".", help="directory with the csv files")
+    profile_parser.add_argument("--output", help="csv file written (reporte_calidad_2016.csv in the directory by default)")
+    args = parser.parse_args()
+
+    if args.command == "optimize":
+        parameter = args.parameter
+        if parameter is not None and args.method == "rolling":
+            parameter = int(parameter)
+        if args.method is not None:
+            import forecasting
+            try:
+                forecasting.check_parameters(args.method, forecasting.DEFAULT_PARAMETERS[args.method]
+                                             if parameter is None else parameter)
+            except ValueError as error:
+                parser.error(str(error))
+        ingredients = optimize(args.directory, args.catalogue, args.margin, args.cost, args.refresh,
+                               args.method, parameter)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(ingredients, file, indent=4)
+        else:
+            json.dump(ingredients, sys.stdout, indent=4)
+            print()
+    elif args.command == "backtest":
+        parameters = args.parameters
+        if parameters is not None and args.method == "rolling":
+            parameters = [int(parameter) for parameter in parameters]
+        if parameters is not None:
+            import forecasting
+            try:
+                forecasting.check_parameters(args.method, parameters)
+            except ValueError as error:
+                parser.error(str(error))
+        counts = load_snapshot(args.directory, args.catalogue, args.refresh)
+        periods = backtest_demand(counts, args.daily, args.seasonal).shape[1]
+        if not 0 < args.start < periods:
+            parser.error(f"--start must be between 1 and {periods - 1}, the periods of the data before the last one, "
+                         f"got {args.start}")
+        results = backtest(args.directory, args.catalogue, args.method, parameters, args.margin, args.cost,
+                           args.start, args.daily, args.seasonal, args.refresh, counts)
+        print(f"{'parameter':<12}{'profit':>14}{'waste':>10}")
+        for result in results:
+            print(f"{str(result['parameter']):<12}{result['profit']:>14.2f}{result['waste']:>10}")
+    elif args.command == "report":
+        report(args.directory, args.output, args.refresh, args.workers, args.raw_rows, args.summary, args.profile)
+    else:
+        profile_data(args.directory, args.output)
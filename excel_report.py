@@ -1,47 +1,94 @@
 import pandas as pd
 import numpy as np
-import copy
+import argparse
+import os
+import cache
+import instrumentation
+from optimization import simulate_profits
 import pizza_analysis_cleaning as pac
 
 
+def frame_columns(worksheet, df):
+    """
+    Columns of a DataFrame as lists of plain Python values, each one with
+    the worksheet method that writes it. Columns with missing values go
+    through the generic write, which leaves them blank.
+    """
+    columns = []
+    for column in df.columns:
+        values = df[column].to_numpy()
+        missing = pd.isna(values)
+        if missing.any():
+            columns.append((worksheet.write, np.where(missing, None, values.astype(object)).tolist()))
+        elif values.dtype.kind in "iuf":
+            columns.append((worksheet.write_number, values.tolist()))
+        else:
+            columns.append((worksheet.write_string, [str(value) for value in values.tolist()]))
+    return columns
+
+
+def write_frames(worksheet, frames, header_format):
+    """
+    Write DataFrames side by side, each one starting at its column.
+    In constant_memory mode rows can only be written in order, so we
+    write the first row of every DataFrame, then the second one...
+    """
+    tables = []
+    for startcol, df in frames:
+        worksheet.write_row(0, startcol, [str(column) for column in df.columns], header_format)
+        tables.append((startcol, len(df), frame_columns(worksheet, df)))
+    for row in range(max(len(df) for _, df in frames)):
+        for startcol, length, columns in tables:
+            if row < length:
+                for col, (write, values) in enumerate(columns, start=startcol):
+                    write(row + 1, col, values[row])
+
+
 def create_excel(optimal_ingredients, df_orders, df_order_details, df_categories,
-                 df_subcategories, df_weekly_pizzas_total, df_profits):
+                 df_subcategories, df_weekly_pizzas_total, df_profits, raw_rows=None, path="report.xlsx",
+                 catalogue=None):
     """
-    Create an Excel writer to generate more than one sheet in the same
-    Excel file. This sheets will contain information about optimal
-    ingredients, orders and order details.
+    Create an Excel file with more than one sheet. This sheets will
+    contain information about optimal ingredients, orders and order details.
+    The rows are streamed straight to the file (constant_memory mode), so
+    the workbook is never held in memory. raw_rows limits the orders and
+    order details sheets to a sample of that many rows, 0 leaves them out.
+    Dates and times are only written as text for the rows exported, and
+    only those order details get their category and subcategory from the
+    catalogue, if one is given (see update_order_details).
     """
-    writer = pd.ExcelWriter("report.xlsx", engine="xlsxwriter")
+    # xlsxwriter is only loaded when a workbook is actually written.
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center"})
 
     # We start generating the ingredients DataFrame
-    ingredients = {"Ingredients": [], "Quantity": []}
-    for key, value in optimal_ingredients.items():
-        ingredients["Ingredients"].append(key)
-        ingredients["Quantity"].append(value)
-    df = pd.DataFrame(ingredients)
+    df = optimal_ingredients.rename_axis("Ingredients").reset_index()
 
     # Now we export them to excel files
-    df.to_excel(writer, sheet_name="optimal_ingredients", index=False)
-    df_orders.to_excel(writer, sheet_name="orders", index=False)
-    df_order_details.to_excel(writer, sheet_name="order_details", index=False)
+    write_frames(workbook.add_worksheet("optimal_ingredients"), [(0, df)], header_format)
+    if raw_rows != 0:
+        for name, df_raw in [("orders", df_orders), ("order_details", df_order_details)]:
+            # A worksheet can't hold more than 1048576 rows, header included.
+            rows = min(len(df_raw) if raw_rows is None else raw_rows, 1048575)
+            if rows < len(df_raw):
+                df_raw = df_raw.sample(rows, random_state=0).sort_index()
+            if name == "orders":
+                df_raw = pac.format_orders(df_raw)
+            elif catalogue is not None:
+                df_raw = update_order_details(df_raw, catalogue)
+            write_frames(workbook.add_worksheet(name), [(0, df_raw)], header_format)
 
     # We also report the executive report DataFrames
-    df_categories.to_excel(writer, sheet_name="executive_report", index=False,
-                           startrow=0, startcol=0)
-    df_subcategories.to_excel(writer, sheet_name="executive_report", index=False,
-                              startrow=0, startcol=3)
-    df_weekly_pizzas_total.to_excel(writer, sheet_name="executive_report", index=False,
-                                    startrow=0, startcol=6)
-    df_profits.to_excel(writer, sheet_name="executive_report", index=False,
-                        startrow=0, startcol=9)
+    worksheet = workbook.add_worksheet("executive_report")
+    write_frames(worksheet, [(0, df_categories), (3, df_subcategories),
+                             (6, df_weekly_pizzas_total), (9, df_profits)], header_format)
 
     # Let's add some graphs
-    workbook = writer.book
-    worksheet = writer.sheets["executive_report"]
     chart1 = workbook.add_chart({"type": "pie"})
     chart1.add_series({
-        "categories": ["executive_report", 1, 0, 4, 0],
-        "values": ["executive_report", 1, 1, 4, 1],
+        "categories": ["executive_report", 1, 0, len(df_categories), 0],
+        "values": ["executive_report", 1, 1, len(df_categories), 1],
         "gap": 2,
         "name": "Total Orders by Category"
     })
@@ -49,8 +96,8 @@ def create_excel(optimal_ingredients, df_orders, df_order_details, df_categories
 
     chart2 = workbook.add_chart({"type": "column"})
     chart2.add_series({
-        "categories": ["executive_report", 1, 3, 32, 3],
-        "values": ["executive_report", 1, 4, 32, 4],
+        "categories": ["executive_report", 1, 3, len(df_subcategories), 3],
+        "values": ["executive_report", 1, 4, len(df_subcategories), 4],
         "gap": 200,
         "name": "Total Orders by Subcategory"
     })
@@ -62,8 +109,8 @@ def create_excel(optimal_ingredients, df_orders, df_order_details, df_categories
 
     chart3 = workbook.add_chart({"type": "line"})
     chart3.add_series({
-        "categories": ["executive_report", 1, 6, 26, 6],
-        "values": ["executive_report", 1, 7, 26, 7],
+        "categories": ["executive_report", 1, 6, len(df_weekly_pizzas_total), 6],
+        "values": ["executive_report", 1, 7, len(df_weekly_pizzas_total), 7],
         "gap": 200,
         "name": "Orders by Week of the Year",
         "marker": {"type": "automatic"},
@@ -73,8 +120,8 @@ def create_excel(optimal_ingredients, df_orders, df_order_details, df_categories
 
     chart4 = workbook.add_chart({"type": "line"})
     chart4.add_series({
-        "categories": ["executive_report", 1, 9, 50, 9],
-        "values": ["executive_report", 1, 10, 50, 10],
+        "categories": ["executive_report", 1, 9, len(df_profits), 9],
+        "values": ["executive_report", 1, 10, len(df_profits), 10],
         "gap": 200,
         "name": "Profits by Week of the Year",
         "marker": {"type": "automatic"},
@@ -83,123 +130,140 @@ def create_excel(optimal_ingredients, df_orders, df_order_details, df_categories
     })
     worksheet.insert_chart("M56", chart4, {"x_scale": 2, "y_sacale": 0.75})
 
-    writer.save()
+    workbook.close()
     return None
 
 
-def create_profits(df_weekly_pizzas, df_prices):
-    weeks = [i for i in range(1, 51)]
-    profits = []
-
-    for i in range(1, 51):
-        profit = 0
-        for j in range(df_weekly_pizzas.shape[0]):
-            pizza = df_weekly_pizzas.iloc[j, 0]
-            price = df_prices.loc[pizza, "price"]
-            sold = df_weekly_pizzas.iloc[j, i]
-            if sold >= df_weekly_pizzas.loc[j, "optimal"]:
-                profit += (df_weekly_pizzas.loc[j, "optimal"] * price * 0.15)  # We add the profit for each pizza sold.
-            else:
-                remaining = df_weekly_pizzas.loc[j, "optimal"] - sold
-                profit -= (remaining * price * 0.85)
-        profits.append(profit)
+def create_profits(df_weekly_pizzas, df_prices, full_weeks=None):
+    """
+    DataFrame with the profit of each of the first full_weeks weeks (every
+    week by default) if we had made the optimal number of pizzas of each type.
+    """
+    columns = pac.full_week_columns(df_weekly_pizzas, full_weeks)
+    weeks = [i for i in range(1, len(columns) + 1)]
+    demand = df_weekly_pizzas[columns].to_numpy()
+    prices = df_prices.loc[df_weekly_pizzas["pizza"], "price"].to_numpy()
+    profits, _ = simulate_profits(demand, prices, df_weekly_pizzas["optimal"].to_numpy())
 
     profits_dict = {"week": weeks,
-                    "profit": profits}
+                    "profit": profits.sum(axis=0)}
     df_profits = pd.DataFrame(profits_dict)
     return df_profits
 
 
 def create_weekly_pizzas_total(df_weekly_pizzas):
-    weekly_pizzas_total = {"weeks": [], "orders": []}
-    week = 1
-    for column in df_weekly_pizzas.columns:
-        if column not in ["pizza", "mean", "optimal"]:
-            if week % 2 == 1:
-                weekly_pizzas_total["weeks"].append(week)
-                weekly_pizzas_total["orders"].append(df_weekly_pizzas[column].sum())
-            week += 1
-
-    df_weekly_pizzas_total = pd.DataFrame(weekly_pizzas_total)
+    """
+    DataFrame with the pizzas sold in every other week, starting with the first one.
+    """
+    weeks = [column for column in df_weekly_pizzas.columns if column not in ["pizza", "mean", "optimal"]]
+    totals = df_weekly_pizzas[weeks].to_numpy().sum(axis=0)
+    df_weekly_pizzas_total = pd.DataFrame({"weeks": np.arange(1, len(weeks) + 1, 2), "orders": totals[::2]})
     return df_weekly_pizzas_total
 
 
-def update_order_details(df_order_details, df_pizza_types):
-    df_order_details.dropna()
-    new_df = copy.deepcopy(df_order_details)
-    new_df["category"] = ""
-    new_df["subcategory"] = ""
-    for i in range(new_df.shape[0]):
-        pizza = new_df.iloc[i, 2]
-        if pizza[-2] != "_":
-            # We check this beacuse the greek pizza can be xl or xxl.
-            pizza = pizza[:9]
-        else:
-            pizza = pizza[:-2]
-        new_df.loc[i, "subcategory"] = pizza
-        j = 0
-        found = False
-        while not found and j < df_pizza_types.shape[0]:
-            if df_pizza_types.iloc[j, 0] == pizza:
-                new_df.loc[i, "category"] = df_pizza_types.iloc[j, 2]
-                found = True
-            j += 1
-    return new_df
-
-
-def create_cat_subcat(df_order_details):
-    total = df_order_details.shape[0] - 1
-    categories = sorted(list(df_order_details["category"].unique()))
-    categories.remove("")
-    counts = [i for i in df_order_details["category"].value_counts().sort_index()]
-    counts.remove(1)
-
-    subcategories = sorted(list(df_order_details["subcategory"].unique()))
-    subcategories.remove("")
-    counts_sub = [i for i in df_order_details["subcategory"].value_counts().sort_index()]
-    counts_sub.remove(1)
+def update_order_details(df_order_details, catalogue):
+    """
+    Add the category and subcategory (pizza type) of every order
+    by looking them up in the catalogue.
+    """
+    pizzas = df_order_details["pizza_id"]
+    return df_order_details.assign(category=pizzas.map(catalogue["category"]).astype(object),
+                                   subcategory=pizzas.map(catalogue["pizza_type_id"]).astype(object))
+
+
+def create_cat_subcat(df_order_details, catalogue):
+    """
+    DataFrames with the order details of each category and the percentage
+    of them of each subcategory (pizza type). The details are counted by
+    pizza id with a bincount on the codes of the pizza_id categorical, and
+    only those counts are grouped by the catalogue.
+    """
+    total = df_order_details.shape[0]
+    codes = df_order_details["pizza_id"].cat.codes.to_numpy()
+    counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(catalogue)), index=catalogue.index)
+
+    counts_cat = counts.groupby(catalogue["category"]).sum()
+    counts_cat = counts_cat[counts_cat > 0].sort_index()
+    counts_sub = counts.groupby(catalogue["pizza_type_id"]).sum()
+    counts_sub = counts_sub[counts_sub > 0].sort_index()
 
     new_counts_sub = [round(count / total * 100, 2) for count in counts_sub]
 
-    dict_categories = {"categories": categories,
-                       "counts": counts}
+    dict_categories = {"categories": list(counts_cat.index),
+                       "counts": list(counts_cat)}
     df_categories = pd.DataFrame(dict_categories)
 
-    dict_subcategories = {"subcategories": subcategories,
-                        "percentage": new_counts_sub}
+    dict_subcategories = {"subcategories": list(counts_sub.index),
+                          "percentage": new_counts_sub}
     df_subcategories = pd.DataFrame(dict_subcategories)
     df_subcategories = df_subcategories.sort_values("percentage", ascending=True)
 
     return df_categories, df_subcategories
 
 
-if __name__ == "__main__":
-    df_order_details = pd.read_csv("order_details.csv", sep=";", encoding="latin1")
-    df_orders = pd.read_csv("orders.csv", sep=";")
-    df_pizzas = pd.read_csv("pizzas.csv")
-    df_pizza_types = pd.read_csv("pizza_types.csv", encoding="latin1")
-
-    df_orders = df_orders.sort_values("order_id")
-    df_orders = df_orders.reset_index(drop=True)
-    df_orders.index = np.arange(1, len(df_orders) + 1)
-    df_order_details = df_order_details.sort_values("order_details_id")
-    df_order_details = df_order_details.reset_index(drop=True)
-    df_order_details.index = np.arange(1, len(df_order_details) + 1)
+def compute_report(catalogue, pizza_ingredients, directory=".", run=None, refresh=False, workers=1):
+    """
+    Clean the orders of the csv files in directory and compute everything
+    the report shows, in the order of the arguments of create_excel.
+    Every stage is recorded in run (see instrumentation).
+    """
+    incidence = pac.create_incidence(pizza_ingredients)
+    df_prices = pac.obtain_prices(catalogue)
+    # The cleaning records its own stages, as a cache hit skips most of them.
+    df_orders, df_order_details, df_weekly_pizzas = cache.load_cleaned_data(
+        os.path.join(directory, "orders.csv"), os.path.join(directory, "order_details.csv"), catalogue,
+        pizza_ingredients, cache_dir=os.path.join(directory, ".cache"), invalidate=refresh, workers=workers,
+        run=run)
+    full_weeks = pac.obtain_full_weeks(df_orders)
+    df_weekly_pizzas = instrumentation.run_stage(run, "add_optimal", pac.add_optimal, df_weekly_pizzas,
+                                                 full_weeks=full_weeks)
+
+    optimal_ingredients = instrumentation.run_stage(run, "obtain_optimal", pac.obtain_optimal,
+                                                    df_weekly_pizzas, incidence)
+
+    df_weekly_pizzas_total = instrumentation.run_stage(run, "create_weekly_pizzas_total",
+                                                       create_weekly_pizzas_total, df_weekly_pizzas)
+    df_profits = instrumentation.run_stage(run, "create_profits", create_profits, df_weekly_pizzas, df_prices,
+                                           full_weeks)
+    df_categories, df_subcategories = instrumentation.run_stage(run, "create_cat_subcat", create_cat_subcat,
+                                                                df_order_details, catalogue)
+    return (optimal_ingredients, df_orders, df_order_details, df_categories, df_subcategories,
+            df_weekly_pizzas_total, df_profits)
+
+
+def create_report(run=None, refresh=False, workers=1, raw_rows=None, directory=".", output=None):
+    """
+    Run the whole pipeline on the csv files of directory and write the
+    report to output ("report.xlsx" in directory by default). Every stage
+    is recorded in run (see instrumentation).
+    """
+    df_pizzas = pd.read_csv(os.path.join(directory, "pizzas.csv"))
+    df_pizza_types = pd.read_csv(os.path.join(directory, "pizza_types.csv"), encoding="latin1")
 
     pizza_ingredients = pac.create_pizza_ingredients(df_pizza_types)
-    ingredients = pac.create_ingredients(pizza_ingredients)
-
-    df_prices = pac.obtain_prices(df_pizzas)
-    df_orders = pac.clean_orders(df_orders)
-    df_order_details = pac.clean_order_details(pizza_ingredients, df_order_details)
-    df_weekly_pizzas = pac.create_weekly_pizzas(df_orders, df_order_details, df_prices, pizza_ingredients)
+    catalogue = pac.create_catalogue(df_pizzas, df_pizza_types)
+    report = compute_report(catalogue, pizza_ingredients, directory, run, refresh, workers)
 
-    optimal_ingredients = pac.obtain_optimal(df_weekly_pizzas, pizza_ingredients, ingredients)
+    if output is None:
+        output = os.path.join(directory, "report.xlsx")
+    instrumentation.run_stage(run, "create_excel", create_excel, *report, raw_rows, output, catalogue)
 
-    df_weekly_pizzas_total = create_weekly_pizzas_total(df_weekly_pizzas)
-    df_profits = create_profits(df_weekly_pizzas, df_prices)
-    df_order_details = update_order_details(df_order_details, df_pizza_types)
-    df_categories, df_subcategories = create_cat_subcat(df_order_details)
 
-    create_excel(optimal_ingredients, df_orders, df_order_details, df_categories,
-                 df_subcategories, df_weekly_pizzas_total, df_profits)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default=".", help="directory with the csv files")
+    parser.add_argument("--output", help="Excel file written (report.xlsx in the directory by default)")
+    parser.add_argument("--refresh", action="store_true", help="rebuild the cached cleaned data")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to clean the data")
+    parser.add_argument("--raw-rows", type=int, default=None,
+                        help="rows sampled for the orders and order details sheets, 0 leaves them out")
+    parser.add_argument("--summary", help="JSON file with the time and memory of every stage")
+    parser.add_argument("--profile", help="directory with a cProfile dump of every stage")
+    args = parser.parse_args()
+    run = None
+    if args.summary or args.profile:
+        run = instrumentation.start_run(profile_dir=args.profile)
+
+    create_report(run, args.refresh, args.workers, args.raw_rows, args.directory, args.output)
+    if run is not None and args.summary:
+        instrumentation.write_summary(run, args.summary)
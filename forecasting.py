@@ -0,0 +1,159 @@
+import numpy as np
+from optimization import optimize_stock, simulate_profits
+
+
+def rolling_mean(counts, window):
+    """
+    Forecast of every period as the mean of the window periods before it
+    (fewer at the start), for every row of a (... x periods) counts array
+    at once. The result has one more period, the forecast of the period
+    after the last one, and NaN for the first period, which has no history.
+    window can be an array of windows, which adds its axes in front.
+    """
+    counts = np.asarray(counts, dtype=float)
+    window = np.asarray(window)[(...,) + (None,) * counts.ndim]
+    cumsum = np.concatenate([np.zeros(counts.shape[:-1] + (1,)), np.cumsum(counts, axis=-1)], axis=-1)
+    periods = np.arange(counts.shape[-1] + 1)
+    start = np.maximum(periods - window, 0)
+    cumsum = np.broadcast_to(cumsum, start.shape[:-counts.ndim] + cumsum.shape)
+    lagged = np.take_along_axis(cumsum, np.broadcast_to(start, cumsum.shape), axis=-1)
+    with np.errstate(invalid="ignore"):
+        return (cumsum - lagged) / (periods - start)
+
+
+def exponential_smoothing(counts, alpha):
+    """
+    Forecast of every period by simple exponential smoothing of the
+    periods before it, starting from the first one, with the same shape
+    as rolling_mean. The recursion is unrolled into a (periods + 1 x
+    periods) matrix of weights, so every row is smoothed with a single
+    matrix product. alpha can be an array, which adds its axes in front.
+    """
+    counts = np.asarray(counts, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)[(...,) + (None,) * max(counts.ndim, 2)]
+    target = np.arange(counts.shape[-1] + 1)[None, :]
+    source = np.arange(counts.shape[-1])[:, None]
+    before = source < target
+    weights = np.where(before, alpha * (1 - alpha) ** np.where(before, target - 1 - source, 0), 0)
+    # The first period starts the smoothing, so it keeps the weight alpha
+    # would have given to everything before it.
+    weights[..., 0, :] = np.where(before[0], (1 - alpha[..., 0, :]) ** np.maximum(target[0] - 1, 0), 0)
+    forecasts = counts @ weights
+    forecasts[..., 0] = np.nan
+    return forecasts
+
+
+METHODS = {"rolling": rolling_mean, "smoothing": exponential_smoothing}
+# Window of the rolling mean and alpha of the smoothing used when none is given.
+DEFAULT_PARAMETERS = {"rolling": 4, "smoothing": 0.3}
+
+
+def check_parameters(method, parameters):
+    """
+    Raise a ValueError unless every one of parameters is a window of at
+    least one period for the rolling mean or an alpha in (0, 1] for the
+    smoothing.
+    """
+    parameters = np.asarray(parameters)
+    if method not in METHODS:
+        raise ValueError(f"Unknown forecasting method {method!r}, expected one of {list(METHODS)}")
+    if method == "rolling" and not (parameters >= 1).all():
+        raise ValueError(f"The windows of the rolling mean must be at least 1, got {parameters.tolist()}")
+    if method == "smoothing" and not ((parameters > 0) & (parameters <= 1)).all():
+        raise ValueError(f"The alphas of the smoothing must be in (0, 1], got {parameters.tolist()}")
+
+
+def weekday_factors(counts, first_weekday):
+    """
+    (... x periods + 1 x 7) array with the pizzas sold on every weekday
+    (0 is Monday) relative to an average day, from (... x days) counts
+    starting on first_weekday. Row t only uses the days before day t, so
+    a forecast never sees the seasonality of the days it forecasts. The
+    factors are 1 until every weekday has been seen once.
+    """
+    counts = np.asarray(counts, dtype=float)
+    weekdays = (first_weekday + np.arange(counts.shape[-1])) % 7
+    onehot = weekdays[:, None] == np.arange(7)
+    zeros = np.zeros(counts.shape[:-1] + (1, 7))
+    sums = np.concatenate([zeros, np.cumsum(counts[..., None] * onehot, axis=-2)], axis=-2)
+    days = np.concatenate([np.zeros((1, 7)), np.cumsum(onehot, axis=0)])
+    means = np.divide(sums, days, out=np.zeros_like(sums), where=days > 0)
+    average = means.mean(axis=-1, keepdims=True)
+    known = (days > 0).all(axis=-1, keepdims=True) & (average > 0)
+    return np.divide(means, average, out=np.ones_like(means), where=known)
+
+
+def forecast(counts, method="smoothing", parameter=None, first_weekday=None):
+    """
+    Forecast of every period of counts and of the next one (see
+    rolling_mean) with one of METHODS, whose window or alpha is parameter
+    (DEFAULT_PARAMETERS by default, see check_parameters).
+    If counts are daily, first_weekday adds the day of the week
+    seasonality: every day is divided by the weekday factors known right
+    after it before the forecast and the forecast of every day is
+    multiplied by the ones known right before it (see weekday_factors).
+    """
+    if parameter is None:
+        parameter = DEFAULT_PARAMETERS.get(method)
+    check_parameters(method, parameter)
+    if first_weekday is None:
+        return METHODS[method](counts, parameter)
+    counts = np.asarray(counts, dtype=float)
+    factors = weekday_factors(counts, first_weekday)
+    periods = np.arange(counts.shape[-1] + 1)
+    weekdays = (first_weekday + periods) % 7
+    seasonal = factors[..., periods, weekdays]
+    adjust = factors[..., periods[1:], weekdays[:-1]]
+    adjusted = np.divide(counts, adjust, out=np.zeros_like(counts), where=adjust > 0)
+    return METHODS[method](adjusted, parameter) * seasonal
+
+
+def expanding_stock(demand, margin=0.15, cost=0.85, start=1):
+    """
+    Stock of every period from start on and of the next one, each one
+    chosen by optimize_stock from the demand of the periods before it
+    alone, so it is never judged on the demand it was chosen from.
+    Periods without any demand before them get 0.
+    """
+    demand = np.asarray(demand)
+    stock = np.zeros(demand.shape[:-1] + (demand.shape[-1] + 1 - start,), dtype=int)
+    for i, period in enumerate(range(start, demand.shape[-1] + 1)):
+        if period > 0:
+            stock[..., i] = optimize_stock(demand[..., :period], margin, cost)
+    return stock
+
+
+def plan_stock(counts, forecasts, margin=0.15, cost=0.85, start=1):
+    """
+    Pizzas to make every period from start on and in the next one, given
+    the forecasts of every period. Each one is the forecast plus the error
+    that optimize_stock would choose as stock from the errors of the
+    forecasts of the periods before it (see expanding_stock), so we make
+    more pizzas of the types whose forecasts fall short more often.
+    """
+    if start < 1:
+        raise ValueError(f"The first period has no forecast, so the stock can only be planned from 1, got {start}")
+    counts = np.asarray(counts)
+    # The first period has no forecast, so the errors start at the second one.
+    errors = counts[..., 1:] - forecasts[..., 1:-1]
+    offset = expanding_stock(errors, margin, cost, start - 1)
+    return np.maximum(np.rint(forecasts[..., start:]) + offset, 0).astype(int)
+
+
+def backtest(counts, prices, method="smoothing", parameters=None, margin=0.15, cost=0.85, start=1,
+             first_weekday=None):
+    """
+    Total profit and waste over the periods from start on of making the
+    stock planned from the forecasts (see plan_stock) with every one of
+    parameters at once, given (pizzas x periods) counts and the price of
+    every pizza. Every stock only depends on the periods before it (see
+    plan_stock), so every parameter is judged on periods it hasn't seen.
+    """
+    if not 0 < start < np.shape(counts)[-1]:
+        raise ValueError(f"The backtest must start between period 1 and {np.shape(counts)[-1] - 1}, got {start}")
+    if parameters is None:
+        parameters = DEFAULT_PARAMETERS.get(method)
+    forecasts = forecast(counts, method, np.asarray(parameters), first_weekday)
+    stock = plan_stock(counts, forecasts, margin, cost, start)[..., :-1]
+    profit, waste = simulate_profits(np.asarray(counts)[..., start:], prices, stock, margin, cost, per_period=True)
+    return profit.sum(axis=(-2, -1)), waste.sum(axis=(-2, -1))
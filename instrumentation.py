@@ -0,0 +1,98 @@
+import pandas as pd
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, so the resident memory isn't recorded there.
+    resource = None
+
+
+def start_run(trace_memory=True, profile_dir=None):
+    """
+    Dictionary in which run_stage records the stages of a run.
+    trace_memory traces the Python allocations of every stage with
+    tracemalloc, which slows them down, and profile_dir is the directory
+    where a cProfile dump of every stage is saved (None to skip them).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    return {"stages": [], "trace_memory": trace_memory, "profile_dir": profile_dir,
+            "start": time.perf_counter()}
+
+
+def count_rows(values):
+    """
+    Number of rows of the DataFrames and Series among values,
+    including the ones inside lists and tuples.
+    """
+    rows = 0
+    for value in values:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            rows += len(value)
+        elif isinstance(value, (list, tuple)):
+            rows += count_rows(value)
+    return rows
+
+
+def process_max_rss():
+    """
+    Peak resident memory of the process since it started, in bytes, or
+    None where it can't be read. ru_maxrss is in bytes on macOS and in
+    KiB on Linux.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def run_stage(run, name, function, *args, **kwargs):
+    """
+    Call function(*args, **kwargs) and record its wall time, CPU time,
+    peak traced memory and the rows of the DataFrames it receives and
+    returns. The peak resident memory recorded is the one of the whole
+    process up to the end of the stage (see process_max_rss), so a stage
+    only shows its own peak when it is higher than every earlier one.
+    With run None the function is just called.
+    """
+    if run is None:
+        return function(*args, **kwargs)
+    if run["trace_memory"]:
+        tracemalloc.reset_peak()
+    profile = cProfile.Profile() if run["profile_dir"] is not None else None
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profile is not None:
+        result = profile.runcall(function, *args, **kwargs)
+        profile.dump_stats(os.path.join(run["profile_dir"], f"{name}.prof"))
+    else:
+        result = function(*args, **kwargs)
+    record = {"stage": name,
+              "wall_time": time.perf_counter() - wall,
+              "cpu_time": time.process_time() - cpu,
+              "peak_traced_bytes": tracemalloc.get_traced_memory()[1] if run["trace_memory"] else None,
+              "process_max_rss_bytes": process_max_rss(),
+              "rows_in": count_rows(list(args) + list(kwargs.values())),
+              "rows_out": count_rows(result if isinstance(result, tuple) else [result])}
+    run["stages"].append(record)
+    return result
+
+
+def write_summary(run, path=None):
+    """
+    Summary of the stages recorded in a run, saved as a JSON file
+    unless path is None.
+    """
+    if run["trace_memory"]:
+        tracemalloc.stop()
+    summary = {"wall_time": time.perf_counter() - run["start"], "stages": run["stages"]}
+    if path is not None:
+        with open(path, "w") as file:
+            json.dump(summary, file, indent=4)
+    return summary
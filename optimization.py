@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def optimize_stock(demand, margin=0.15, cost=0.85, deviations=None):
+    """
+    Compute the optimal number of pizzas of each type to make every week
+    from a (pizzas x weeks) demand array. Any leading axes (e.g. stores)
+    are optimized at once as well.
+    Every pizza we can't sell because we run out loses its margin and every
+    pizza we make but don't sell loses its cost, both as a fraction of the
+    price. The price scales both losses equally, so it doesn't change the
+    optimum. By default we return the exact optimum, which is the
+    margin / (margin + cost) quantile of the weekly demand. If deviations
+    are given we instead try every deviation from the mean and keep the
+    one with the least loses over all the weeks.
+    """
+    demand = np.asarray(demand)
+    if deviations is None:
+        ratio = margin / (margin + cost)
+        return np.quantile(demand, ratio, axis=-1, method="inverted_cdf").astype(int)
+    mean = demand.mean(axis=-1).astype(int)
+    candidates = mean[..., None] + np.asarray(deviations)
+    difference = candidates[..., None] - demand[..., None, :]
+    loses = np.where(difference < 0, -difference * margin, difference * cost).sum(axis=-1)
+    best = loses.argmin(axis=-1)
+    return np.take_along_axis(candidates, best[..., None], axis=-1)[..., 0]
+
+
+def simulate_profits(demand, prices, stock, margin=0.15, cost=0.85, per_period=False):
+    """
+    Profit and waste of making stock pizzas of each type every week given
+    a (pizzas x weeks) demand array and the price of each pizza. When we
+    sell every pizza we make we earn their margin, otherwise we lose the
+    cost of the ones left. stock can also be a (policies x pizzas) array,
+    then we get a (policies x pizzas x weeks) profit and waste for each one.
+    With per_period the last axis of stock already has the stock of every
+    week, as planned from a forecast.
+    """
+    demand = np.asarray(demand)
+    prices = np.asarray(prices, dtype=float)[:, None]
+    stock = np.asarray(stock) if per_period else np.asarray(stock)[..., None]
+    waste = np.maximum(stock - demand, 0)
+    profit = np.where(demand >= stock, stock * prices * margin, -waste * prices * cost)
+    return profit, waste
+
+
+def obtain_ingredient_demand(incidence, demand):
+    """
+    Ingredients needed to make a number of pizzas of each type, as a
+    single matrix product. The first axis of demand follows the rows of
+    incidence, so a (pizzas,) array gives an (ingredients,) one and a
+    (pizzas x weeks) or (pizzas x policies) array gives an
+    (ingredients x weeks) or (ingredients x policies) one. incidence can
+    be the DataFrame of pac.create_incidence or a boolean array.
+    """
+    return np.tensordot(np.asarray(incidence, dtype=np.int64).T, np.asarray(demand), axes=1)
@@ -0,0 +1,66 @@
+import pandas as pd
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pizza_analysis_cleaning as pac
+
+
+def split_file(path, shards):
+    """
+    Byte ranges splitting the rows of a csv file into contiguous shards
+    of about the same size. Every range starts at the beginning of a row.
+    Small files give fewer ranges than shards, as empty ones are dropped.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        offsets = [len(file.readline())]
+        for shard in range(1, shards):
+            file.seek(max(offsets[0] + (size - offsets[0]) * shard // shards, offsets[-1]))
+            if file.tell() != offsets[0]:
+                file.seek(file.tell() - 1)
+                file.readline()
+            offsets.append(file.tell())
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if start < end]
+
+
+def normalize_orders_shard(path, start, end):
+    return pac.normalize_orders(pac.read_orders(path, start, end))
+
+
+def normalize_order_details_shard(path, start, end):
+    return pac.normalize_order_details(pac.read_order_details(path, start, end))
+
+
+def normalize_sharded(function, path, sort_by, workers):
+    """
+    Read and normalize each shard of the file in its own process and
+    stitch them back sorted by id. Every worker reads its own byte range,
+    so only the normalized rows are sent back to this process.
+    """
+    ranges = split_file(path, workers) or [(0, None)]
+    starts, ends = zip(*ranges)
+    with ProcessPoolExecutor(len(ranges)) as executor:
+        shards = list(executor.map(function, [path] * len(ranges), starts, ends))
+    df = pd.concat(shards).sort_values(sort_by)
+    df.index = np.arange(1, len(df) + 1)
+    return df
+
+
+def normalize_orders(path, workers):
+    """
+    Normalized orders (see pac.normalize_orders) of the file, sorted by id.
+    The missing values are then filled in a single pass over all of them
+    with pac.fill_orders, so the fills across shard edges are the same as
+    in a single process.
+    """
+    return normalize_sharded(normalize_orders_shard, path, "order_id", workers)
+
+
+def normalize_order_details(path, workers):
+    """
+    Normalized order details (see pac.normalize_order_details) of the file,
+    sorted by id. The missing pizzas are then drawn in order with
+    pac.fill_order_details.
+    """
+    return normalize_sharded(normalize_order_details_shard, path, "order_details_id", workers)
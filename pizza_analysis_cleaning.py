@@ -1,9 +1,12 @@
 import pandas as pd
-import datetime as dt
 from typing import Dict
 import numpy as np
-import random
-import re
+import argparse
+import io
+import json
+import forecasting
+import instrumentation
+from optimization import optimize_stock, obtain_ingredient_demand
 
 
 def create_pizza_ingredients(df_pizza_types) -> Dict:
@@ -17,110 +20,174 @@ def create_pizza_ingredients(df_pizza_types) -> Dict:
     return pizza_ingredients
 
 
-def create_ingredients(pizza_ingredients) -> Dict:
+def create_incidence(pizza_ingredients):
     """
-    Create a dictionary with the amount of each ingredient we need.
-    By default it starts as 0.
+    Boolean DataFrame with a row per pizza and a column per ingredient,
+    True when the pizza has that ingredient. The ingredients are split
+    only once here and keep the order in which they first appear.
     """
-    ingredients = {}
-    for value in pizza_ingredients.values():
-        particular_ingredients = value.split(", ")
-        for ingredient in particular_ingredients:
-            if ingredient not in ingredients:
-                ingredients[ingredient] = 0
-    return ingredients
+    ingredients = pd.Series(pizza_ingredients).str.split(", ").explode()
+    incidence = pd.crosstab(ingredients.index, ingredients.values).astype(bool)
+    incidence = incidence.reindex(index=list(pizza_ingredients), columns=ingredients.unique(), fill_value=False)
+    return incidence.rename_axis(index="pizza", columns="ingredient")
 
 
-def obtain_prices(df_pizzas):
+def create_catalogue(df_pizzas, df_pizza_types):
     """
-    DataFrame containing the price of each pizza
+    DataFrame indexed by pizza_id with the type, size, price, name,
+    category and list of ingredients of every pizza. It is built once so
+    orders can be enriched with a single map or join instead of scanning
+    the pizza types for every order.
     """
-    return df_pizzas.groupby("pizza_type_id").sum()/3
+    df_types = df_pizza_types.set_index("pizza_type_id")
+    catalogue = df_pizzas.join(df_types, on="pizza_type_id").set_index("pizza_id")
+    catalogue["ingredients"] = catalogue["ingredients"].str.split(", ")
+    return catalogue
 
 
-def create_weekly_pizzas(df_orders, df_order_details, df_prices, pizza_ingredients):
+def obtain_prices(catalogue):
+    """
+    DataFrame containing the price of each pizza, the mean of the
+    prices of all its sizes
+    """
+    return catalogue.groupby("pizza_type_id")[["price"]].mean()
+
+
+def obtain_weeks(df_orders):
+    """
+    Series indexed by order id with the week of the year in which each
+    order was placed. Week 1 starts on the date of the first order.
+    """
+    dates = df_orders["date"]
+    weeks = (dates - dates.min()).dt.days // 7 + 1
+    return pd.Series(weeks.values, index=df_orders["order_id"].values)
+
+
+def obtain_full_weeks(df_orders):
+    """
+    Number of weeks (see obtain_weeks) whose seven days all fall between
+    the first and the last order. The last week is left out when the
+    orders end before it does.
+    """
+    dates = df_orders["date"]
+    return max(((dates.max() - dates.min()).days + 1) // 7, 1)
+
+
+def full_week_columns(df_weekly_pizzas, full_weeks=None):
+    """
+    Columns of the first full_weeks weeks of a DataFrame with the pizzas
+    sold each week (every week by default).
+    """
+    weeks = [column for column in df_weekly_pizzas.columns if column.startswith("week ")]
+    return weeks if full_weeks is None else weeks[:full_weeks]
+
+
+def create_weekly_pizzas(df_orders, df_order_details, catalogue, pizza_ingredients,
+                         margin=0.15, cost=0.85, deviations=None):
     """
     Create a new DataFrame representing the number of pizzas sold each
-    week of 2015. This information helps us to compute the optimal number
-    of pizzas we need to make to maximize the profits. We do this by computing
-    the weekly average number of pizzas sold for each type. Then, we use the
-    average profit margin of pizzas in USA, 15%, to calculate the optimal number
-    of pizzas to make in order to lose as little money as possible.
-    For each pizza type, we add the total money we would have lost each week
-    if we had made a certain amount of pizzas. Then we pick the amount of
-    pizzas with lhe least loses as optimal for each type. It is important to note
-    that we have considered that the ingredients bought expire in a week, so there
-    is no chnave they can be used the following week.
-    """
-    df_weekly_pizzas = pd.DataFrame()
-    df_weekly_pizzas["pizza"] = pizza_ingredients.keys()
-    df_weekly_pizzas["week 1"] = 0
-    count = 0
-    day = "01"
-    i = 1
-    j = 1
-    # i represents the order id, j represnts the order details for each order id
-    while i < df_orders.shape[0]:
-        date = df_orders.loc[i, "date"]
-        if date[:2] != day:
-            count += 1
-            day = date[:2]
-            if count % 7 == 0:
-                df_weekly_pizzas[f"week {int(count / 7) + 1}"] = 0
-        while df_order_details.iloc[j, 1] == i and j < df_order_details.shape[0]:
-            pizza = df_order_details.iloc[j, 2]
-            quantity = int(df_order_details.iloc[j, 3])
-            if pizza[-2] != "_":
-                # We check this beacuse the greek pizza can be xl or xxl.
-                pizza = pizza[:9]
-            else:
-                pizza = pizza[:-2]
-            index = df_weekly_pizzas[df_weekly_pizzas["pizza"] == pizza].index
-            df_weekly_pizzas.loc[index, f"week {int(count / 7) + 1}"] += quantity
-            j += 1
-        i += 1
-    df_weekly_pizzas["mean"] = df_weekly_pizzas.iloc[:, 1:52].sum(axis=1)/51
-    # We add up to 51 weeks because the last one isn't complete
-    df_weekly_pizzas["optimal"] = 0
-    values = range(-8, 0)   # Deviations from the mean.
-    for i in range(df_weekly_pizzas.shape[0]):
-        profits = {}
-        # A dicitonary in which keys are possible deviations form the mean (-8 to +3)
-        # and values are profit for each deviation
-        for value in values:
-            profits[value] = 0
-            mean = int(df_weekly_pizzas.loc[i, "mean"]) + value
-            for j in range(1, 52):
-                difference = mean - df_weekly_pizzas.iloc[i, j]
-                if difference < 0:
-                    profits[value] -= abs(difference)*df_prices.loc[df_weekly_pizzas.iloc[i, 0], "price"] * 0.15
-                    # Supposing we have a 15% profit for each sold pizza
-                elif difference > 0:
-                    profits[value] -= abs(difference)*df_prices.loc[df_weekly_pizzas.iloc[i, 0], "price"] * 0.85
-                    # Because you spent a 85% of the final price but didn't sell it
-        # Maximum profit and optimal deviations from the mean (will be updated in the second loop
-        maximum = -100000
-        optimal = 0
-        for key, profit in profits.items():
-            if maximum != max(maximum, profit):
-                maximum, optimal = profit, key
-        df_weekly_pizzas.loc[i, "optimal"] = int(mean) + optimal
-        # Column in which we select the optimal number of pizzas to make in a week.
+    week of the year. This information helps us to compute the optimal number
+    of pizzas we need to make to maximize the profits. We use the average
+    profit margin of pizzas in USA, 15%, to calculate the optimal number
+    of pizzas to make in order to lose as little money as possible
+    (see optimize_stock). It is important to note that we have considered
+    that the ingredients bought expire in a week, so there is no chance they
+    can be used the following week.
+    """
+    weeks = obtain_weeks(df_orders)
+    df_weekly_pizzas = count_weekly_pizzas(weeks, df_order_details, catalogue, pizza_ingredients)
+    return add_optimal(df_weekly_pizzas, margin, cost, deviations, full_weeks=obtain_full_weeks(df_orders))
+
+
+def count_weekly_pizzas(weeks, df_order_details, catalogue, pizza_ingredients):
+    """
+    DataFrame with the number of pizzas of each type sold every week,
+    given the week of every order (see obtain_weeks). The pizzas and
+    weeks are turned into integer codes and counted with a single bincount.
+    """
+    pizzas = list(pizza_ingredients.keys())
+    pizza_codes = catalogue["pizza_type_id"].map({pizza: i for i, pizza in enumerate(pizzas)})
+    counts = np.zeros((len(pizzas), weeks.max()), dtype=np.int64)
+    fold_weekly_pizzas(counts, df_order_details, weeks, pizza_codes)
+    df_weekly_pizzas = pd.DataFrame(counts, columns=[f"week {week}" for week in range(1, counts.shape[1] + 1)])
+    df_weekly_pizzas.insert(0, "pizza", pizzas)
     return df_weekly_pizzas
 
 
-def obtain_optimal(df_weekly_pizzas, pizza_ingredients, ingredients):
+def count_daily_pizzas(df_orders, df_order_details, catalogue, pizza_ingredients):
     """
-    Iterate through the column optimal of df_weekly_pizzas to
-    work out the aumount of each ingredient we need to be able to sell
-    the number of pizzas previously calculated
+    (pizzas x days) array with the number of pizzas of each type sold
+    every day since the first order, in the order of pizza_ingredients,
+    and the weekday of the first day (0 is Monday).
     """
-    for index, row in df_weekly_pizzas.iterrows():
-        pizza = row["pizza"]
-        quantity = int(row["optimal"])
-        for ingredient in pizza_ingredients[pizza].split(", "):
-            ingredients[ingredient] += quantity
-    return ingredients
+    dates = df_orders["date"]
+    days = pd.Series(((dates - dates.min()).dt.days + 1).values, index=df_orders["order_id"].values)
+    pizzas = list(pizza_ingredients.keys())
+    pizza_codes = catalogue["pizza_type_id"].map({pizza: i for i, pizza in enumerate(pizzas)})
+    counts = np.zeros((len(pizzas), days.max()), dtype=np.int64)
+    fold_weekly_pizzas(counts, df_order_details, days, pizza_codes)
+    return counts, dates.min().dayofweek
+
+
+def fold_weekly_pizzas(counts, df_order_details, weeks, pizza_codes):
+    """
+    Add the pizzas of cleaned order details to running (pizzas x weeks)
+    counts. pizza_codes gives the row of every pizza of the catalogue,
+    in the order of the categories of pizza_id. weeks can also number
+    days, for (pizzas x days) counts.
+    """
+    n_weeks = counts.shape[1]
+    codes = df_order_details["pizza_id"].cat.codes.to_numpy()
+    pizzas = np.where(codes >= 0, pizza_codes.to_numpy(dtype=float)[codes], np.nan)
+    order_weeks = weeks.reindex(df_order_details["order_id"].to_numpy()).to_numpy(dtype=float)
+    known = ~np.isnan(pizzas) & ~np.isnan(order_weeks)
+    cells = pizzas[known].astype(np.int64) * n_weeks + order_weeks[known].astype(np.int64) - 1
+    quantities = df_order_details["quantity"].to_numpy()[known]
+    counts += np.bincount(cells, weights=quantities, minlength=counts.size).reshape(counts.shape).astype(np.int64)
+    return counts
+
+
+def add_optimal(df_weekly_pizzas, margin=0.15, cost=0.85, deviations=None, method=None, parameter=None,
+                full_weeks=None):
+    """
+    Add the mean and the optimal number of pizzas to make each week
+    to a DataFrame with the pizzas sold each week. With a forecasting
+    method (see forecasting.forecast) the optimal is instead the stock
+    planned for the week after the last one from its forecast.
+    Only the first full_weeks weeks are used (see obtain_full_weeks).
+    """
+    # We leave out the last week when it isn't complete
+    demand = df_weekly_pizzas[full_week_columns(df_weekly_pizzas, full_weeks)].to_numpy()
+    df_weekly_pizzas["mean"] = demand.sum(axis=1)/demand.shape[1]
+    if method is None:
+        df_weekly_pizzas["optimal"] = optimize_stock(demand, margin, cost, deviations)
+    else:
+        forecasts = forecasting.forecast(demand, method, parameter)
+        df_weekly_pizzas["optimal"] = forecasting.plan_stock(demand, forecasts, margin, cost)[:, -1]
+    # Column in which we select the optimal number of pizzas to make in a week.
+    return df_weekly_pizzas
+
+
+def obtain_optimal(df_weekly_pizzas, incidence):
+    """
+    Series with the amount of each ingredient we need to be able to sell
+    the optimal number of pizzas of every type (column optimal of
+    df_weekly_pizzas).
+    """
+    incidence = incidence.loc[df_weekly_pizzas["pizza"]]
+    quantities = obtain_ingredient_demand(incidence, df_weekly_pizzas["optimal"].to_numpy())
+    return pd.Series(quantities, index=incidence.columns, name="Quantity")
+
+
+def obtain_weekly_ingredients(df_weekly_pizzas, incidence):
+    """
+    DataFrame with the amount of each ingredient used every week by the
+    pizzas sold that week.
+    """
+    weeks = [column for column in df_weekly_pizzas.columns if column.startswith("week ")]
+    incidence = incidence.loc[df_weekly_pizzas["pizza"]]
+    quantities = obtain_ingredient_demand(incidence, df_weekly_pizzas[weeks].to_numpy())
+    return pd.DataFrame(quantities, index=incidence.columns, columns=weeks)
 
 
 def show_strategy(optimal_ingredients):
@@ -134,17 +201,13 @@ def show_strategy(optimal_ingredients):
         print(key + " "*(spaces - len(key)) + str(value))
 
 
-def create_csv(optimal_ingredients):
+def create_csv(optimal_ingredients, path="optimal_ingredients.csv"):
     """
-    Create a new dictionary to transform our data into
-    a DataFrame so it can be displayes as a csv
+    Save the Series of ingredients we need (see obtain_optimal)
+    as a csv
     """
-    ingredients = {"Ingredients": [], "Quantity": []}
-    for key, value in optimal_ingredients.items():
-        ingredients["Ingredients"].append(key)
-        ingredients["Quantity"].append(value)
-    df = pd.DataFrame(ingredients)
-    df.to_csv("optimal_ingredients.csv")
+    df = optimal_ingredients.rename_axis("Ingredients").reset_index()
+    df.to_csv(path)
 
 
 def recognize_format_date(str_date):
@@ -185,107 +248,356 @@ def recognize_format_time(str_time):
             return "%HH %MM %SS"
 
 
+def recognize_formats_date(dates):
+    """
+    Vectorized version of recognize_format_date. Returns a Series with
+    the format of every date, using string masks instead of a Python
+    call per row.
+    """
+    dates = dates.astype(object)
+    nan = dates.isna()
+    text = dates.where(~nan, "")
+    formats = pd.Series("%b %d %Y", index=dates.index, dtype=object)
+    formats[text.str.contains(",", regex=False)] = "%A,%d %B, %Y"
+    dash = text.str.contains("-", regex=False)
+    formats[dash] = "%Y-%m-%d"
+    formats[dash & ~text.str[:1].str.isdigit()] = "%a %d-%b-%Y"
+    formats[dash & text.str.contains(":", regex=False)] = "%d-%m-%y %H:%M:%S"
+    formats[text.str.contains(".", regex=False)] = "1"
+    formats[nan] = "0"
+    return formats
+
+
+def recognize_formats_time(times):
+    """
+    Vectorized version of recognize_format_time.
+    """
+    times = times.astype(object)
+    nan = times.isna()
+    text = times.where(~nan, "")
+    formats = pd.Series("%HH %MM %SS", index=times.index, dtype=object)
+    colon = text.str.contains(":", regex=False)
+    formats[colon] = "%H:%M PM"
+    formats[colon & (text.str[-2:-1] == "A")] = "%H:%M AM"
+    formats[colon & text.str[-1:].str.isdigit()] = "%H:%M:%S"
+    formats[nan] = "0"
+    return formats
+
+
+def parse_dates(dates, date_format):
+    """
+    Parse a group of dates sharing the same format with a single
+    pd.to_datetime call. Dates that do not match are retried with a "0"
+    inserted after the fourth character, as the old row by row cleaner did.
+    """
+    parsed = pd.to_datetime(dates, format=date_format, errors="coerce")
+    failed = parsed.isna()
+    if failed.any():
+        retry = dates[failed].str[:4] + "0" + dates[failed].str[4:]
+        parsed[failed] = pd.to_datetime(retry, format=date_format)
+    return parsed
+
+
+def fill_dates(dates, missing, timestamp):
+    """
+    Fill the missing dates of orders sorted by id. Dates stored as
+    timestamps take the date of the following order as long as only
+    timestamps lie between them. Any other missing date, including
+    timestamps followed by a missing one, takes the date of the previous
+    order.
+    """
+    dates = dates.copy()
+    next_missing = missing.astype(float).where(~timestamp).bfill()
+    next_date = dates.where(~missing).bfill()
+    previous_date = dates.where(~missing).ffill()
+    previous_date = previous_date.fillna(dates.where(~missing).dropna().iloc[-1])
+    backward = timestamp & (next_missing == 0)
+    dates[missing] = previous_date[missing]
+    dates[backward] = next_date[backward]
+    return dates
+
+
 def clean_orders(df_orders):
-    for i in range(df_orders.shape[0]):
-        date_format = recognize_format_date(df_orders.iloc[i, 1])
-        time_format = recognize_format_time(df_orders.iloc[i, 2])
-        if ":" in date_format:
-            new_date = str(dt.datetime.strptime(df_orders.iloc[i, 1], date_format)).split()[0]
-            date = new_date
-            date = date[8:] + "/" + date[5:7] + "/" + date[:4]
-            df_orders.iloc[i, 1] = date
+    """
+    Normalize the date and time of every order. Each format group is
+    parsed at once and the missing values are filled from their
+    neighbours in a single pass.
+    """
+    return fill_orders(normalize_orders(df_orders))
 
-        else:
-            if date_format != "0" and date_format != "1":
-                try:
-                    new_date = str(dt.datetime.strptime(f"{df_orders.iloc[i, 1]}", f"{date_format}")).split()
-                except:
-                    df_orders.iloc[i, 1] = str(df_orders.iloc[i, 1])[:4] + "0" + str(df_orders.iloc[i, 1])[4:]
-                    new_date = str(dt.datetime.strptime(f"{df_orders.iloc[i, 1]}", f"{date_format}")).split()
-                date = new_date[0]
-                date = date[8:] + "/" + date[5:7] + "/" + date[:4]
-                df_orders.iloc[i, 1] = date
-        if time_format not in ["%H:%M:%S", "0", "1"]:
-            hour = df_orders.iloc[i, 2]
-            if "A" in time_format or "P" in time_format:
-                hour = df_orders.iloc[i, 2]
-                if "A" in time_format or int(hour[:2]) >= 12:
-                    new_hour = hour[0:5] + ":" + "00"
-                else:
-                    new_hour = str(int(hour[0:2]) + 12) + ":" + hour[4:5] + ":" + "00"
-            else:
-                new_hour = hour[0:2] + ":" + hour[4:6] + ":" + hour[8:10]
-            df_orders.iloc[i, 2] = new_hour
-    for j in range(5):
-        for i in range(df_orders.shape[0]):
-            date_format = recognize_format_date(df_orders.iloc[i, 1])
-            time_format = recognize_format_time(df_orders.iloc[i, 2])
-            if time_format == "0":
-                df_orders.iloc[i, 2] = df_orders.iloc[i - 1, 2]
-            if date_format == "0":
-                df_orders.iloc[i, 1] = df_orders.iloc[i - 1, 1]
-            elif date_format == "1":
-                df_orders.iloc[i, 1] = df_orders.iloc[i + 1, 1]
+
+def normalize_orders(df_orders):
+    """
+    Parse every date into a datetime64 day and every time into an int32
+    number of seconds since midnight. Missing dates and dates stored as
+    timestamps are left as NaT, the latter flagged in a timestamp column,
+    and missing times are left as 0, so each order can be normalized on
+    its own.
+    """
+    dates = df_orders["date"].astype(object)
+    times = df_orders["time"].astype(object)
+    date_formats = recognize_formats_date(dates)
+    time_formats = recognize_formats_time(times)
+
+    new_dates = pd.Series(pd.NaT, index=dates.index, dtype="datetime64[ns]")
+    for date_format in date_formats.unique():
+        if date_format not in ["0", "1"]:
+            group = date_formats == date_format
+            new_dates[group] = parse_dates(dates[group], date_format).dt.normalize()
+
+    # A numpy array keeps its int32 dtype even when a group covers every row.
+    new_times = np.zeros(len(times), dtype=np.int32)
+    am_pm = time_formats.isin(["%H:%M AM", "%H:%M PM"]).to_numpy()
+    hours = times[am_pm].str[0:2].astype(int)
+    evening = (time_formats[am_pm] == "%H:%M PM") & (hours < 12)
+    new_times[am_pm] = (hours + 12 * evening) * 3600 + times[am_pm].str[3:5].astype(int) * 60
+    for time_format, (hour, minute, second) in [("%H:%M:%S", (0, 3, 6)), ("%HH %MM %SS", (0, 4, 8))]:
+        group = (time_formats == time_format).to_numpy()
+        clock = times[group]
+        new_times[group] = (clock.str[hour:hour + 2].astype(int) * 3600 + clock.str[minute:minute + 2].astype(int) * 60
+                            + clock.str[second:second + 2].astype(int))
+
+    df_orders["date"] = new_dates
+    df_orders["time"] = new_times
+    df_orders["timestamp"] = (date_formats == "1").values
+    return df_orders
+
+
+def fill_orders(df_orders):
+    """
+    Fill the missing dates and times of normalized orders sorted by id
+    from their neighbours.
+    """
+    timestamp = df_orders["timestamp"]
+    new_dates = fill_dates(df_orders["date"], df_orders["date"].isna(), timestamp)
 
     # To get rid of the orders from which we don't know the hour but we
     # know the time, we replicate the time of the previous order, avoiding
     # possible mistakes of other methods. We just say that there were two
     # orders at the same time.
-    for i in range(df_orders.shape[0]):
-        if df_orders.iloc[i, 2] == "00:00:00":
-            df_orders.iloc[i, 2] = df_orders.iloc[i - 1, 2]
+    new_times = df_orders["time"]
+    missing = new_times == 0
+    previous_time = new_times.where(~missing).ffill()
+    previous_time = previous_time.fillna(new_times.where(~missing).dropna().iloc[-1])
+    new_times = new_times.where(~missing, previous_time).astype(np.int32)
+
+    df_orders = df_orders.drop(columns="timestamp")
+    df_orders["date"] = new_dates
+    df_orders["time"] = new_times
     return df_orders
 
 
-def clean_order_details(pizza_ingredients, df_order_details):
-    for i in range(df_order_details.shape[0]):
-        pizza = df_order_details.iloc[i, 2]
-        if type(pizza) != float:
-            pizza = re.sub("[ -]", "_", pizza)
-            pizza = re.sub("3", "e", pizza)
-            pizza = re.sub("@", "a", pizza)
-            pizza = re.sub("0", "o", pizza)
-            df_order_details.iloc[i, 2] = pizza
-        quantity = df_order_details.iloc[i, 3]
-        if quantity in ["one", "One", "-1"] or type(quantity) == float:
-            quantity = "1"
-            df_order_details.iloc[i, 3] = quantity
-        elif quantity in ["two", "Two", "-2"]:
-            quantity = "2"
-            df_order_details.iloc[i, 3] = quantity
-    sizes = ["s", "m", "l"]
-    pizzas = list(pizza_ingredients.keys())
-    for i in range(df_order_details.shape[0]):
-        if type(df_order_details.iloc[i, 2]) == float:
-            df_order_details.iloc[i, 2] = pizzas[random.randint(0, len(pizzas) - 1)] + f"_{sizes[random.randint(0, 2)]}"
+def format_orders(df_orders):
+    """
+    Copy of cleaned orders with the dates written as "dd/mm/yyyy" and the
+    times as "HH:MM:SS", as they are shown in the report.
+    """
+    times = pd.Timestamp(0) + pd.to_timedelta(df_orders["time"], unit="s")
+    return df_orders.assign(date=df_orders["date"].dt.strftime("%d/%m/%Y"), time=times.dt.strftime("%H:%M:%S"))
+
+
+def clean_order_details(catalogue, df_order_details, seed=0, drawn=0):
+    """
+    Normalize the pizza ids and quantities of every order detail.
+    The misspelt characters of the pizza ids are translated all at once,
+    the quantities written as words or negative numbers are mapped to
+    integers and the missing pizza ids are drawn from the catalogue with
+    a seeded generator, so every run gives the same result. drawn is the
+    number of draws already used by earlier order details of the same run.
+    """
+    return fill_order_details(catalogue, normalize_order_details(df_order_details), seed, drawn)
+
+
+def normalize_order_details(df_order_details):
+    """
+    Fix the pizza ids and quantities of every order detail on its own,
+    leaving the missing pizza ids as they are. Negative quantities are
+    taken as positive, as "-1" and "-2", and a ValueError is raised for
+    any quantity that isn't a whole number from 1 to 255 after that.
+    """
+    df_order_details["pizza_id"] = df_order_details["pizza_id"].str.translate(str.maketrans(" -3@0", "__eao"))
+    spellings = {"one": "1", "One": "1", "-1": "1", "two": "2", "Two": "2", "-2": "2"}
+    quantities = pd.to_numeric(df_order_details["quantity"].replace(spellings)).fillna(1).abs()
+    # They are stored as uint8, which would silently wrap anything else.
+    invalid = (quantities < 1) | (quantities > 255) | (quantities % 1 != 0)
+    if invalid.any():
+        raise ValueError(f"Quantities out of the range 1 to 255 in order details "
+                         f"{df_order_details.loc[invalid, 'order_details_id'].tolist()[:10]}: "
+                         f"{df_order_details.loc[invalid, 'quantity'].tolist()[:10]}")
+    df_order_details["quantity"] = quantities.astype(np.uint8)
+    return df_order_details
+
+
+def fill_order_details(catalogue, df_order_details, seed=0, drawn=0):
+    """
+    Draw the missing pizza ids of order details sorted by id. The pizza
+    ids are returned as a categorical backed by the catalogue.
+    """
+    pizzas = df_order_details["pizza_id"].astype(object)
+    missing = pizzas.isna()
+    rng = np.random.default_rng(seed)
+    pizzas[missing] = rng.choice(catalogue.index.to_numpy(), size=drawn + missing.sum())[drawn:]
+    df_order_details["pizza_id"] = pd.Categorical(pizzas, categories=catalogue.index.to_numpy())
     return df_order_details
 
 
-def create_inform(dfs):
+def read_rows(path, start=0, end=None, **kwargs):
+    """
+    Read the rows of a csv file between two byte offsets (the whole
+    file by default), keeping its header.
+    """
+    with open(path, "rb") as file:
+        header = file.readline()
+        file.seek(max(start, len(header)))
+        rows = file.read() if end is None else file.read(max(end - file.tell(), 0))
+    return pd.read_csv(io.BytesIO(header + rows), **kwargs)
+
+
+def read_orders(path, start=0, end=None):
+    """
+    Orders between two byte offsets of the file, sorted by id with a 1-based index.
+    The ids are read as integers even when there are no rows, so the
+    orders of any two ranges can be concatenated.
+    """
+    df_orders = read_rows(path, start, end, sep=";", dtype={"order_id": np.int64, "date": object, "time": object})
+    df_orders = df_orders.sort_values("order_id")
+    df_orders.index = np.arange(1, len(df_orders) + 1)
+    return df_orders
+
+
+def read_order_details(path, start=0, end=None):
+    """
+    Order details between two byte offsets of the file, sorted by id with a 1-based index.
+    """
+    dtypes = {"order_details_id": np.int64, "order_id": np.int64, "pizza_id": object, "quantity": object}
+    df_order_details = read_rows(path, start, end, sep=";", encoding="latin1", dtype=dtypes)
+    df_order_details = df_order_details.sort_values("order_details_id")
+    df_order_details.index = np.arange(1, len(df_order_details) + 1)
+    return df_order_details
+
+
+def classify_pizza_ids(pizzas, catalogue=None):
+    """
+    Kind of every pizza id: "valid", "misspelt" (fixed by
+    normalize_order_details), "unknown" or "missing". Without a
+    catalogue every id without misspelt characters is taken as valid.
+    """
+    pizzas = pizzas.astype(object)
+    fixed = pizzas.str.translate(str.maketrans(" -3@0", "__eao"))
+    if catalogue is None:
+        valid, known = fixed == pizzas, fixed.notna()
+    else:
+        valid, known = pizzas.isin(catalogue.index), fixed.isin(catalogue.index)
+    kinds = pd.Series("unknown", index=pizzas.index, dtype=object)
+    kinds[known] = "misspelt"
+    kinds[valid] = "valid"
+    kinds[pizzas.isna()] = "missing"
+    return kinds
+
+
+def classify_quantities(quantities):
+    """
+    "valid" for the quantities written as positive numbers, the
+    quantity itself for the rest ("one", "-1", "nan"...).
+    """
+    quantities = quantities.astype(object).astype(str)
+    return quantities.where(~quantities.str.fullmatch("[1-9][0-9]*"), "valid")
+
+
+def update_profile(profile, table, df, catalogue=None):
+    """
+    Fold a DataFrame, or a chunk of one, into a data quality profile:
+    a dictionary with the type, rows, missing values, hashes of the
+    distinct values and counts of each format of every column. Each
+    column is scanned once per chunk, so a profile can be built while
+    the files are streamed.
+    """
+    for column in df.columns:
+        values = df[column]
+        stats = profile.setdefault((table, column), {"type": str(values.dtype), "rows": 0, "n_nans": 0,
+                                                     "hashes": np.empty(0, dtype=np.uint64), "formats": None})
+        missing = values.isna()
+        stats["rows"] += len(values)
+        stats["n_nans"] += int(missing.sum())
+        hashes = pd.util.hash_pandas_object(values[~missing], index=False).to_numpy()
+        stats["hashes"] = np.union1d(stats["hashes"], hashes)
+        kinds = None
+        if column == "date":
+            kinds = recognize_formats_date(values)
+        elif column == "time":
+            kinds = recognize_formats_time(values)
+        elif column == "pizza_id":
+            kinds = classify_pizza_ids(values, catalogue)
+        elif column == "quantity":
+            kinds = classify_quantities(values)
+        if kinds is not None:
+            stats["formats"] = stats["formats"] or {}
+            for kind, count in kinds.value_counts().items():
+                stats["formats"][kind] = stats["formats"].get(kind, 0) + int(count)
+    return profile
+
+
+def create_profile_report(profile):
+    """
+    DataFrame with a row for every column of a data quality profile.
+    n_malformed counts the pizza ids and quantities that aren't valid.
+    """
     informe = {
+        "table": [],
         "column_name": [],
         "type": [],
         "n_nans": [],
-        "n_nulls": []}
-    for df in dfs:
-        for column in df.columns:
-            informe["column_name"].append(column)
-            informe["n_nans"].append(df[column].isna().sum())
-            informe["n_nulls"].append(df[column].isnull().sum())
-        for i in range(df.shape[1]):
-            ty = str(df.dtypes[i])
-            informe["type"].append(ty)
+        "n_nulls": [],
+        "n_unique": [],
+        "n_malformed": [],
+        "formats": []}
+    for (table, column), stats in profile.items():
+        formats = stats["formats"]
+        informe["table"].append(table)
+        informe["column_name"].append(column)
+        informe["type"].append(stats["type"])
+        informe["n_nans"].append(stats["n_nans"])
+        informe["n_nulls"].append(stats["n_nans"])
+        informe["n_unique"].append(len(stats["hashes"]))
+        if column in ["pizza_id", "quantity"]:
+            informe["n_malformed"].append(stats["rows"] - formats.get("valid", 0))
+        else:
+            informe["n_malformed"].append(None)
+        informe["formats"].append(None if formats is None else json.dumps(formats))
     df = pd.DataFrame(informe)
-    df.to_csv("reporte_calidad_2016.csv")
+    df["n_malformed"] = df["n_malformed"].astype("Int64")
+    return df
+
+
+def create_inform(dfs, names=None, catalogue=None, path="reporte_calidad_2016.csv"):
+    """
+    Save a data quality report of the DataFrames (see update_profile).
+    """
+    profile = {}
+    for i, df in enumerate(dfs):
+        update_profile(profile, i if names is None else names[i], df, catalogue)
+    df = create_profile_report(profile)
+    df.to_csv(path)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--summary", help="JSON file with the time and memory of every stage")
+    parser.add_argument("--profile", help="directory with a cProfile dump of every stage")
+    args = parser.parse_args()
+    run = None
+    if args.summary or args.profile:
+        run = instrumentation.start_run(profile_dir=args.profile)
+
     df_order_details = pd.read_csv("order_details.csv", sep=";", encoding="latin1")
     df_orders = pd.read_csv("orders.csv", sep=";")
     df_pizzas = pd.read_csv("pizzas.csv")
     df_pizza_types = pd.read_csv("pizza_types.csv", encoding="latin1")
 
-    create_inform([df_orders, df_order_details, df_pizzas, df_pizza_types])
+    catalogue = create_catalogue(df_pizzas, df_pizza_types)
+    instrumentation.run_stage(run, "create_inform", create_inform,
+                              [df_orders, df_order_details, df_pizzas, df_pizza_types],
+                              ["orders", "order_details", "pizzas", "pizza_types"], catalogue)
 
     df_orders = df_orders.sort_values("order_id")
     df_orders = df_orders.reset_index(drop=True)
@@ -295,14 +607,18 @@ if __name__ == "__main__":
     df_order_details.index = np.arange(1, len(df_order_details) + 1)
 
     pizza_ingredients = create_pizza_ingredients(df_pizza_types)
-    ingredients = create_ingredients(pizza_ingredients)
+    incidence = create_incidence(pizza_ingredients)
 
-    df_prices = obtain_prices(df_pizzas)
-    df_orders = clean_orders(df_orders)
-    df_order_details = clean_order_details(pizza_ingredients, df_order_details)
-    df_weekly_pizzas = create_weekly_pizzas(df_orders, df_order_details, df_prices, pizza_ingredients)
+    df_orders = instrumentation.run_stage(run, "clean_orders", clean_orders, df_orders)
+    df_order_details = instrumentation.run_stage(run, "clean_order_details", clean_order_details,
+                                                 catalogue, df_order_details)
+    df_weekly_pizzas = instrumentation.run_stage(run, "create_weekly_pizzas", create_weekly_pizzas,
+                                                 df_orders, df_order_details, catalogue, pizza_ingredients)
 
-    optimal_ingredients = obtain_optimal(df_weekly_pizzas, pizza_ingredients, ingredients)
+    optimal_ingredients = instrumentation.run_stage(run, "obtain_optimal", obtain_optimal,
+                                                    df_weekly_pizzas, incidence)
 
     show_strategy(optimal_ingredients)
-    create_csv(optimal_ingredients)
+    instrumentation.run_stage(run, "create_csv", create_csv, optimal_ingredients)
+    if run is not None and args.summary:
+        instrumentation.write_summary(run, args.summary)
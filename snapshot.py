@@ -0,0 +1,85 @@
+import numpy as np
+import json
+import os
+import shutil
+
+# Bumped whenever the layout of a snapshot changes.
+VERSION = 5
+
+
+def save_snapshot(path, sources, meta=None, **arrays):
+    """
+    Save arrays computed from the source files as a directory with one
+    .npy file per array and a snapshot.json with the version, the size and
+    modification time of the sources and any other meta (JSON values).
+    The directory is written under another name and renamed at the end,
+    so readers never see half a snapshot.
+    """
+    temporary = path + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for name, values in arrays.items():
+        np.save(os.path.join(temporary, name + ".npy"), np.asarray(values), allow_pickle=False)
+    with open(os.path.join(temporary, "snapshot.json"), "w") as file:
+        json.dump({**(meta or {}), **source_stats(sources), "version": VERSION, "arrays": list(arrays)}, file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(temporary, path)
+
+
+def source_stats(sources):
+    sources = [os.path.abspath(source) for source in sources]
+    stats = [os.stat(source) for source in sources]
+    return {"sources": sources, "sizes": [stat.st_size for stat in stats],
+            "mtimes": [stat.st_mtime_ns for stat in stats]}
+
+
+def touch_snapshot(path, sources):
+    """
+    Record the current size and modification time of the sources of a
+    snapshot, when they were touched but their content didn't change.
+    This also marks the snapshot as just used.
+    """
+    with open(os.path.join(path, "snapshot.json")) as file:
+        meta = json.load(file)
+    with open(os.path.join(path, "snapshot.json"), "w") as file:
+        json.dump({**meta, **source_stats(sources)}, file)
+
+
+def open_snapshot(path):
+    """
+    Dictionary with the meta of a snapshot and its arrays, memory-mapped
+    read only. Nothing is read until it is used and every process that
+    opens the same snapshot shares its pages. Returns None if the
+    snapshot is missing or has another version.
+    """
+    try:
+        with open(os.path.join(path, "snapshot.json")) as file:
+            meta = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if meta.get("version") != VERSION:
+        return None
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+    return {**meta, **arrays}
+
+
+def find_snapshot(cache_dir, sources, dependencies=()):
+    """
+    Newest snapshot in cache_dir saved from the same source files, which
+    have not changed since, and newer than every dependency file (e.g. the
+    catalogue). Returns it opened (see open_snapshot) or None.
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+    stats = source_stats(sources)
+    paths = [os.path.join(cache_dir, name, "snapshot.json") for name in os.listdir(cache_dir)]
+    paths = [path for path in paths if os.path.isfile(path)]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        saved = os.stat(path).st_mtime_ns
+        if any(os.stat(dependency).st_mtime_ns > saved for dependency in dependencies):
+            continue
+        with open(path) as file:
+            meta = json.load(file)
+        if all(meta.get(name) == stats[name] for name in stats):
+            return open_snapshot(os.path.dirname(path))
+    return None
@@ -0,0 +1,92 @@
+import pandas as pd
+import numpy as np
+import pizza_analysis_cleaning as pac
+
+
+def stream_order_weeks(orders_path, chunksize=100000, profile=None):
+    """
+    Read the orders in chunks and return a Series indexed by order id
+    with the week in which each order was placed, and the number of full
+    weeks (see pac.obtain_full_weeks). For every order we only
+    keep its parsed day, so the date strings of a chunk are discarded as
+    soon as it has been parsed. Each chunk is also folded into profile
+    (see pac.update_profile) if one is given.
+    """
+    chunks = []
+    dtypes = {"order_id": np.int64, "date": object, "time": object}
+    usecols = ["order_id", "date"] if profile is None else None
+    for chunk in pd.read_csv(orders_path, sep=";", usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        if profile is not None:
+            pac.update_profile(profile, "orders", chunk)
+        date_formats = pac.recognize_formats_date(chunk["date"])
+        days = pd.Series(np.nan, index=chunk.index)
+        for date_format in date_formats.unique():
+            if date_format not in ["0", "1"]:
+                group = date_formats == date_format
+                parsed = pac.parse_dates(chunk.loc[group, "date"], date_format)
+                days[group] = parsed.values.astype("datetime64[D]").astype(np.int64)
+        chunks.append(pd.DataFrame({"day": days.values,
+                                    "missing": date_formats.isin(["0", "1"]).values,
+                                    "timestamp": (date_formats == "1").values},
+                                   index=chunk["order_id"].values))
+    df_days = pd.concat(chunks).sort_index()
+    # The missing dates are filled from the neighbour orders once all of
+    # them are sorted by id, as clean_orders does.
+    days = pac.fill_dates(df_days["day"], df_days["missing"], df_days["timestamp"])
+    full_weeks = max(int(days.max() - days.min() + 1) // 7, 1)
+    return ((days - days.min()) // 7 + 1).astype(np.int16), full_weeks
+
+
+def stream_weekly_pizzas(orders_path, order_details_path, catalogue, pizza_ingredients,
+                         chunksize=100000, seed=0, margin=0.15, cost=0.85, deviations=None, profile=None):
+    """
+    Streaming version of create_weekly_pizzas. The order details are read,
+    cleaned and folded into the weekly counts one chunk at a time, so we
+    never hold more than a chunk of them in memory.
+    The details without pizza are put aside and filled at the end in
+    order_details_id order, so they get the same pizzas as they would
+    in clean_order_details. The raw chunks are folded into profile if one
+    is given, so the data quality report costs little beyond the read.
+    """
+    weeks, full_weeks = stream_order_weeks(orders_path, chunksize, profile)
+    pizzas = list(pizza_ingredients.keys())
+    pizza_codes = catalogue["pizza_type_id"].map({pizza: i for i, pizza in enumerate(pizzas)})
+    counts = np.zeros((len(pizzas), weeks.max()), dtype=np.int64)
+
+    unknown = []
+    dtypes = {"order_details_id": np.int64, "order_id": np.int64,
+              "pizza_id": "category", "quantity": "category"}
+    for chunk in pd.read_csv(order_details_path, sep=";", encoding="latin1",
+                             dtype=dtypes, chunksize=chunksize):
+        if profile is not None:
+            pac.update_profile(profile, "order_details", chunk, catalogue)
+        missing = chunk["pizza_id"].isna()
+        unknown.append(chunk[missing])
+        chunk = pac.clean_order_details(catalogue, chunk[~missing].copy(), seed)
+        pac.fold_weekly_pizzas(counts, chunk, weeks, pizza_codes)
+    df_unknown = pd.concat(unknown).sort_values("order_details_id")
+    df_unknown = pac.clean_order_details(catalogue, df_unknown.astype(object), seed)
+    pac.fold_weekly_pizzas(counts, df_unknown, weeks, pizza_codes)
+
+    df_weekly_pizzas = pd.DataFrame(counts, columns=[f"week {week}" for week in range(1, counts.shape[1] + 1)])
+    df_weekly_pizzas.insert(0, "pizza", pizzas)
+    return pac.add_optimal(df_weekly_pizzas, margin, cost, deviations, full_weeks=full_weeks)
+
+
+if __name__ == "__main__":
+    df_pizzas = pd.read_csv("pizzas.csv")
+    df_pizza_types = pd.read_csv("pizza_types.csv", encoding="latin1")
+
+    pizza_ingredients = pac.create_pizza_ingredients(df_pizza_types)
+    incidence = pac.create_incidence(pizza_ingredients)
+
+    catalogue = pac.create_catalogue(df_pizzas, df_pizza_types)
+    profile = {}
+    df_weekly_pizzas = stream_weekly_pizzas("orders.csv", "order_details.csv", catalogue, pizza_ingredients,
+                                            profile=profile)
+    pac.create_profile_report(profile).to_csv("reporte_calidad_2016.csv")
+
+    optimal_ingredients = pac.obtain_optimal(df_weekly_pizzas, incidence)
+
+    pac.show_strategy(optimal_ingredients)
+    pac.create_csv(optimal_ingredients)